@@ -0,0 +1,91 @@
+import io
+import os
+import tarfile
+import time
+import zipfile
+
+# Các định dạng đã nén sẵn, nén thêm lần nữa chỉ tốn CPU.
+_STORED_EXTENSIONS = {'.pdf', '.epub', '.jpg', '.jpeg', '.png', '.gif'}
+
+
+class _ZipWriter:
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def add(self, arcname, data):
+        compress = zipfile.ZIP_STORED if os.path.splitext(arcname)[1].lower() in _STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        self._zip.writestr(arcname, data, compress_type=compress)
+
+    def close(self):
+        self._zip.close()
+
+
+class _TarWriter:
+    def __init__(self, path):
+        self._tar = tarfile.open(path, 'w')
+
+    def add(self, arcname, data):
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = time.time()
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._tar.close()
+
+
+_WRITERS = {'zip': _ZipWriter, 'tar': _TarWriter}
+
+
+class OutputArchive:
+    """
+    Streams exported files into one archive per story or per volume instead of
+    creating thousands of small files. The layout under `output_folder` (volume
+    folders) is kept inside the archive.
+
+    - kind: 'zip' or 'tar'.
+    - scope: 'story' writes `<output_folder>/<story_name>.<kind>`; 'volume' writes one
+      `<volume>.<kind>` per volume folder (files outside a volume go to the story archive).
+
+    Archives are written to a `.part` file and renamed on close(), so an interrupted
+    run never leaves a truncated archive under the final name.
+    """
+
+    def __init__(self, output_folder, story_name, kind='zip', scope='story'):
+        if kind not in _WRITERS:
+            raise ValueError(f"Định dạng lưu trữ không hỗ trợ: {kind}")
+        self.output_folder = output_folder
+        self.story_name = story_name
+        self.kind = kind
+        self.scope = scope
+        self._writers = {}
+        self.files = 0
+
+    def _archive_name(self, relpath):
+        parts = relpath.split('/')
+        if self.scope == 'volume' and len(parts) > 1:
+            return parts[0]
+        return self.story_name
+
+    def add(self, filename, data):
+        """Adds the bytes of `filename` (a path under output_folder) to its archive."""
+        relpath = os.path.relpath(filename, self.output_folder).replace(os.sep, '/')
+        name = self._archive_name(relpath)
+        writer = self._writers.get(name)
+        if writer is None:
+            final_path = os.path.join(self.output_folder, f"{name}.{self.kind}")
+            writer = _WRITERS[self.kind](final_path + ".part")
+            self._writers[name] = writer
+        writer.add(relpath, data)
+        self.files += 1
+
+    def close(self):
+        """Finalizes every archive and returns their paths."""
+        paths = []
+        for name, writer in self._writers.items():
+            writer.close()
+            final_path = os.path.join(self.output_folder, f"{name}.{self.kind}")
+            os.replace(final_path + ".part", final_path)
+            paths.append(final_path)
+        self._writers = {}
+        return paths
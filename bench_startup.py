@@ -0,0 +1,58 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Các module nặng không được phép bị import khi chỉ `import scraper`.
+HEAVY_MODULES = [
+    'playwright', 'ebooklib', 'reportlab', 'PIL', 'bs4',
+    'alive_progress', 'simple_term_menu',
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import scraper
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def do_thoi_gian_import(so_lan):
+    """
+    Imports `scraper` in a fresh interpreter `so_lan` times and returns the
+    timings (seconds) plus the heavy modules that got pulled in.
+    """
+    timings = []
+    loaded = set()
+    for _ in range(so_lan):
+        result = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(data["elapsed"])
+        loaded.update(data["loaded"])
+    return timings, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian khởi động (import) của scraper.py.")
+    parser.add_argument('-n', '--lan', type=int, default=10, help="Số lần đo. Mặc định: 10.")
+    parser.add_argument('--nguong', type=float, default=None, help="Ngưỡng trung vị (ms); vượt quá thì trả về mã lỗi 1.")
+    args = parser.parse_args()
+
+    timings, loaded = do_thoi_gian_import(args.lan)
+    median_ms = statistics.median(timings) * 1000
+    print(f"import scraper: trung vị {median_ms:.1f} ms, nhỏ nhất {min(timings) * 1000:.1f} ms, lớn nhất {max(timings) * 1000:.1f} ms ({args.lan} lần)")
+
+    exit_code = 0
+    if loaded:
+        print(f"(!) Các module nặng bị import khi khởi động: {', '.join(loaded)}")
+        exit_code = 1
+    if args.nguong is not None and median_ms > args.nguong:
+        print(f"(!) Thời gian khởi động vượt ngưỡng {args.nguong:.1f} ms.")
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
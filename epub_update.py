@@ -0,0 +1,194 @@
+import html
+import os
+import posixpath
+import re
+import zipfile
+from xml.sax.saxutils import escape as xml_escape, quoteattr
+
+# Khung XHTML cho chương mới, tương đương với khung ebooklib dùng khi ghi EPUB.
+_CHAPTER_TEMPLATE = """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="vi" xml:lang="vi">
+<head>
+  <title>{title}</title>
+</head>
+<body>{body}</body>
+</html>
+"""
+
+
+
+def _attr(tag, name):
+    match = re.search(rf'\b{name}="([^"]*)"', tag)
+    return html.unescape(match.group(1)) if match else None
+
+
+class EpubInfo:
+    """
+    What an existing EPUB already contains: the OPF location, its nav/NCX documents,
+    chapter titles (from the NCX) and the next free chapter/image numbers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as zf:
+            container = zf.read('META-INF/container.xml').decode('utf-8')
+            self.opf_path = re.search(r'full-path="([^"]+)"', container).group(1)
+            self.opf_dir = posixpath.dirname(self.opf_path)
+            opf = zf.read(self.opf_path).decode('utf-8')
+            self.items = {}
+            for tag in re.findall(r'<(?:\w+:)?item\b[^>]*>', opf):
+                self.items[_attr(tag, 'id')] = (_attr(tag, 'href') or '', _attr(tag, 'properties') or '')
+            self.nav_path = next((self._entry(href) for href, props in self.items.values() if 'nav' in props.split()), None)
+            self.ncx_path = next((self._entry(href) for href, _ in self.items.values() if href.endswith('.ncx')), None)
+            ncx = zf.read(self.ncx_path).decode('utf-8') if self.ncx_path else ''
+
+        self.chapter_titles = [html.unescape(t) for t in re.findall(r'<text>(.*?)</text>', ncx, re.S)[1:]]
+        hrefs = [href for href, _ in self.items.values()]
+        self.next_chapter = 1 + max((int(n) for h in hrefs for n in re.findall(r'chap_(\d+)\.xhtml$', h)), default=0)
+        self.next_image = 1 + max((int(n) for h in hrefs for n in re.findall(r'images/image_(\d+)\.\w+$', h)), default=0)
+
+    def _entry(self, href):
+        return posixpath.normpath(posixpath.join(self.opf_dir, href)) if self.opf_dir else href
+
+
+# Thuộc tính nội bộ của ZipFile mà _ghi_muc_tho dùng tới (có từ Python 3.6 đến nay).
+_ZIP_INTERNALS = ('fp', 'filelist', 'NameToInfo', 'start_dir', '_didModify')
+
+
+def _co_the_chep_tho(zout):
+    return hasattr(zipfile.ZipInfo, 'FileHeader') and all(hasattr(zout, name) for name in _ZIP_INTERNALS)
+
+
+def _ghi_muc_tho(zout, info, raw):
+    """
+    Appends an entry whose data is already compressed to `zout`. This is the only
+    place that touches ZipFile internals; zipfile has no public API for it.
+
+    It is safe because it does what ZipFile.writestr does once the data is
+    compressed. `zout` is opened fresh in 'w' mode and only written sequentially,
+    so the entry goes at the end of the file: the local header (ZipInfo.FileHeader),
+    then the data. The ZipInfo is registered in `filelist`/`NameToInfo`, which is
+    what close() builds the central directory from. `start_dir` moves past the
+    entry and `_didModify` is set so close() writes that directory at the right
+    offset. CRC and sizes come unchanged from the source entry and go in the
+    header (no data descriptor), so testzip() verifies the result normally.
+    """
+    info.header_offset = zout.fp.tell()
+    zout.fp.write(info.FileHeader())
+    zout.fp.write(raw)
+    zout.filelist.append(info)
+    zout.NameToInfo[info.filename] = info
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+
+def _copy_entry(src_fp, zin, info, zout):
+    """
+    Copies one entry of `zin` into `zout` as raw compressed bytes (no decompression
+    or recompression). If a future Python drops the internals _ghi_muc_tho needs,
+    or the entry is encrypted, the entry is decompressed and written again through
+    the public API instead.
+    """
+    if info.flag_bits & 0x01 or not _co_the_chep_tho(zout):
+        zout.writestr(info, zin.read(info))
+        return
+    src_fp.seek(info.header_offset)
+    header = src_fp.read(30)
+    name_len = int.from_bytes(header[26:28], 'little')
+    extra_len = int.from_bytes(header[28:30], 'little')
+    src_fp.seek(info.header_offset + 30 + name_len + extra_len)
+    raw = src_fp.read(info.compress_size)
+
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.external_attr = info.external_attr
+    new_info.create_system = info.create_system
+    # Kích thước và CRC đã biết, ghi thẳng vào header thay vì data descriptor.
+    new_info.flag_bits = info.flag_bits & ~0x08
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    _ghi_muc_tho(zout, new_info, raw)
+
+
+def _insert_before_last(text, closing_tag_pattern, addition):
+    matches = list(re.finditer(closing_tag_pattern, text))
+    if not matches:
+        raise ValueError(f"Không tìm thấy thẻ {closing_tag_pattern} trong EPUB.")
+    pos = matches[-1].start()
+    return text[:pos] + addition + text[pos:]
+
+
+def them_chuong_epub(info, chapters, images):
+    """
+    Appends chapters to an existing EPUB in place.
+
+    - info: EpubInfo of the file.
+    - chapters: [(title, body html)], numbered from info.next_chapter.
+    - images: [(file name, media type, bytes)] stored under `images/`.
+
+    Only the OPF (manifest + spine), nav and NCX are rewritten; every other entry is
+    copied with its original compressed bytes, so the cost is proportional to the
+    new chapters rather than the whole book.
+    """
+    opf_rel = lambda entry: posixpath.relpath(entry, info.opf_dir) if info.opf_dir else entry
+    nav_rel = lambda entry: posixpath.relpath(entry, posixpath.dirname(info.nav_path)) if info.nav_path else entry
+    ncx_rel = lambda entry: posixpath.relpath(entry, posixpath.dirname(info.ncx_path)) if info.ncx_path else entry
+
+    new_entries = {}
+    manifest, spine, nav_items, ncx_points = '', '', '', ''
+    with zipfile.ZipFile(info.path) as zf:
+        opf = zf.read(info.opf_path).decode('utf-8')
+        nav = zf.read(info.nav_path).decode('utf-8') if info.nav_path else None
+        ncx = zf.read(info.ncx_path).decode('utf-8') if info.ncx_path else None
+    play_order = max((int(n) for n in re.findall(r'playOrder="(\d+)"', ncx or '')), default=0)
+
+    for img_filename, media_type, content in images:
+        entry = info._entry(f'images/{img_filename}')
+        item_id = os.path.splitext(img_filename)[0]
+        new_entries[entry] = content
+        manifest += f'<item href="{opf_rel(entry)}" id="{item_id}" media-type="{media_type}"/>'
+
+    for offset, (title, body) in enumerate(chapters):
+        number = info.next_chapter + offset
+        item_id = f'chap_{number}'
+        while item_id in info.items:
+            item_id += '_'
+        entry = info._entry(f'chap_{number}.xhtml')
+        new_entries[entry] = _CHAPTER_TEMPLATE.format(title=xml_escape(title), body=body).encode('utf-8')
+        manifest += f'<item href="{opf_rel(entry)}" id="{item_id}" media-type="application/xhtml+xml"/>'
+        spine += f'<itemref idref="{item_id}"/>'
+        nav_items += f'<li><a href={quoteattr(nav_rel(entry))}>{xml_escape(title)}</a></li>'
+        # Chỉ đánh playOrder nếu NCX hiện có dùng thuộc tính này (ebooklib không ghi nó).
+        play_order_attr = ''
+        if play_order:
+            play_order += 1
+            play_order_attr = f' playOrder="{play_order}"'
+        ncx_points += (f'<navPoint id="{item_id}"{play_order_attr}><navLabel><text>{xml_escape(title)}</text>'
+                       f'</navLabel><content src={quoteattr(ncx_rel(entry))}/></navPoint>')
+
+    opf = _insert_before_last(opf, r'</(?:\w+:)?manifest>', manifest)
+    opf = _insert_before_last(opf, r'</(?:\w+:)?spine>', spine)
+    rewritten = {info.opf_path: opf.encode('utf-8')}
+    if nav is not None:
+        toc_start = re.search(r'<nav\b[^>]*epub:type="toc"', nav)
+        toc_end = nav.index('</nav>', toc_start.end())
+        ol_end = nav.rindex('</ol>', toc_start.end(), toc_end)
+        rewritten[info.nav_path] = (nav[:ol_end] + nav_items + nav[ol_end:]).encode('utf-8')
+    if ncx is not None:
+        rewritten[info.ncx_path] = _insert_before_last(ncx, r'</navMap>', ncx_points).encode('utf-8')
+
+    tmp_path = info.path + ".part"
+    with open(info.path, 'rb') as src_fp, zipfile.ZipFile(info.path) as zin, \
+            zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for entry_info in zin.infolist():
+            if entry_info.filename in rewritten:
+                zout.writestr(entry_info.filename, rewritten[entry_info.filename])
+            else:
+                _copy_entry(src_fp, zin, entry_info, zout)
+        for entry, content in new_entries.items():
+            # Ảnh đã được nén sẵn, không cần nén thêm.
+            compress = zipfile.ZIP_STORED if entry.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')) else zipfile.ZIP_DEFLATED
+            zout.writestr(entry, content, compress_type=compress)
+    os.replace(tmp_path, info.path)
@@ -0,0 +1,91 @@
+import json
+import os
+import time
+
+
+def _ghi_json(path, data):
+    tmp_path = path + ".part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class FailureLedger:
+    """
+    Machine-readable record of what failed in a run, so a later run can retry only
+    those items (`--retry-failed`) instead of the whole selection.
+
+    Each entry is keyed by (target, stage):
+    - target: the chapter URL (stage 'scrape') or the output file path (stage 'export').
+    - error: exception class name of the last failure, message: its text.
+    - attempts: number of failed attempts recorded so far (kept across runs).
+
+    `run` holds the settings of the original run (selection, formats, ...) and
+    `content` ({chapter url: content list}) the chapters collected so far; it is stored
+    next to the ledger, so a retry can re-export merged files without scraping the
+    chapters that succeeded.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None, run=None):
+        self.path = path
+        self.run = run or {}
+        self.content = {}
+        self._entries = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        ledger = cls(path, data.get('run'))
+        for entry in data.get('failures', []):
+            ledger._entries[(entry['target'], entry['stage'])] = entry
+        try:
+            with open(ledger.content_path, encoding='utf-8') as f:
+                ledger.content = json.load(f)
+        except FileNotFoundError:
+            pass
+        return ledger
+
+    @property
+    def content_path(self):
+        return os.path.splitext(self.path)[0] + "_noi_dung.json"
+
+    def record(self, target, stage, error, message=None, **fields):
+        """Records one failed attempt; `error` is an exception or an error class name."""
+        if isinstance(error, BaseException):
+            message = str(error) if message is None else message
+            error = type(error).__name__
+        entry = self._entries.setdefault((target, stage), {'target': target, 'stage': stage, 'attempts': 0})
+        entry.update(fields)
+        entry['error'] = error
+        entry['message'] = message or ''
+        entry['attempts'] += 1
+        entry['ts'] = round(time.time(), 3)
+
+    def resolve(self, target, stage):
+        """Drops the entry of an item that has now succeeded."""
+        self._entries.pop((target, stage), None)
+
+    def has(self, target, stage):
+        return (target, stage) in self._entries
+
+    def entries(self, stage=None):
+        return [entry for entry in self._entries.values() if stage is None or entry['stage'] == stage]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self):
+        """
+        Writes the ledger and its content next to each other. An empty ledger removes
+        both files: there is nothing left to retry.
+        """
+        if not self._entries:
+            for path in (self.path, self.content_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        _ghi_json(self.path, {'version': self.VERSION, 'run': self.run, 'failures': list(self._entries.values())})
+        _ghi_json(self.content_path, self.content)
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import time
+
+import requests
+
+# Loại tài nguyên tĩnh (JS, CSS, font, ảnh) luôn được phục vụ từ bộ nhớ đệm nếu có.
+STATIC_RESOURCE_TYPES = {'stylesheet', 'script', 'font', 'image', 'media'}
+# Loại phản hồi "động" (trang chương, API) chỉ được ghi/phát lại khi bật chế độ replay.
+REPLAY_RESOURCE_TYPES = {'document', 'xhr', 'fetch'}
+# Các header không còn đúng sau khi body đã được giải nén và lưu lại.
+_DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a URL is not in the cache."""
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class HttpCache:
+    """
+    A record/replay cache for Playwright navigations, installed on a browser context
+    through request interception.
+
+    - Static assets (JS bundles, CSS, fonts, images) are stored once and served locally.
+    - When `replay` is enabled, documents and API responses are also recorded, HAR-style
+      (url, status, headers, body), and replayed until they are older than `ttl` seconds.
+    - When `offline` is enabled, cache misses are aborted instead of hitting the network.
+    """
+
+    def __init__(self, cache_dir=".http_cache", replay=False, ttl=None, offline=False):
+        self.cache_dir = cache_dir
+        self.replay = replay
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def _should_handle(self, request):
+        if request.method != 'GET':
+            return False
+        if request.resource_type in STATIC_RESOURCE_TYPES:
+            return True
+        return self.replay and request.resource_type in REPLAY_RESOURCE_TYPES
+
+    def load(self, url, resource_type):
+        """Returns a cached entry {'status', 'headers', 'body'} or None on miss/expiry."""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            # Ở chế độ offline mọi dữ liệu đã ghi đều được dùng, kể cả khi đã quá ttl.
+            if resource_type not in STATIC_RESOURCE_TYPES and self.ttl is not None and not self.offline:
+                if time.time() - meta.get('stored_at', 0) > self.ttl:
+                    return None
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return {'status': meta['status'], 'headers': meta['headers'], 'body': body}
+
+    def store(self, url, resource_type, status, headers, body):
+        """Writes an entry atomically so concurrent pages never read a half-written file."""
+        meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = {
+            'url': url,
+            'resource_type': resource_type,
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() not in _DROPPED_HEADERS},
+            'stored_at': time.time(),
+        }
+        # Ghi body trước, meta sau: meta tồn tại nghĩa là body đã đầy đủ.
+        _write_atomic(body_path, body)
+        _write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def fetch(self, url, resource_type, timeout=30):
+        """
+        Fetches `url` with requests through the cache, for downloads made outside the
+        browser (sitemap, cover, images). Same rules as for page requests: static
+        resources are always cached, documents only in replay mode. Returns
+        (body, content_type); raises CacheMiss offline and requests' HTTPError on errors.
+        """
+        handled = resource_type in STATIC_RESOURCE_TYPES or (self.replay and resource_type in REPLAY_RESOURCE_TYPES)
+        if handled:
+            cached = self.load(url, resource_type)
+            if cached is not None:
+                self.hits += 1
+                return cached['body'], _header(cached['headers'], 'content-type')
+            self.misses += 1
+        if self.offline:
+            raise CacheMiss(f"Không có trong bộ nhớ đệm (offline): {url}")
+
+        response = requests.get(url, timeout=timeout)
+        response.raise_for_status()
+        if handled and response.status_code == 200:
+            self.store(url, resource_type, response.status_code, dict(response.headers), response.content)
+        return response.content, response.headers.get('Content-Type', '')
+
+    async def _handle_route(self, route, request):
+        if not self._should_handle(request):
+            await route.continue_()
+            return
+
+        cached = self.load(request.url, request.resource_type)
+        if cached is not None:
+            self.hits += 1
+            await route.fulfill(status=cached['status'], headers=cached['headers'], body=cached['body'])
+            return
+
+        self.misses += 1
+        if self.offline:
+            await route.abort()
+            return
+
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except Exception:
+            # Trang đã đóng hoặc lỗi mạng: để Playwright tự xử lý như bình thường.
+            await route.continue_()
+            return
+        if response.status == 200:
+            self.store(request.url, request.resource_type, response.status, response.headers, body)
+        await route.fulfill(response=response, body=body)
+
+    async def attach(self, context):
+        """Installs the cache on a Playwright BrowserContext (or Page)."""
+        await context.route("**/*", self._handle_route)
+        return context
+
+
+def _header(headers, name):
+    return next((value for key, value in headers.items() if key.lower() == name), '')
+
+
+def tai_url(url, http_cache=None, resource_type='image', timeout=30):
+    """
+    Downloads `url` and returns (body, content_type), through `http_cache` when one is
+    given so `--offline` runs never touch the network.
+    """
+    if http_cache is not None:
+        return http_cache.fetch(url, resource_type, timeout)
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content, response.headers.get('Content-Type', '')
+
+
+async def tao_context(browser, http_cache=None, block_profile=None, **context_options):
+    """
+    Creates a new browser context with the HTTP cache and the resource-blocking
+    profile attached (if given). The returned context exposes `new_page()` just
+    like the browser itself.
+    """
+    context = await browser.new_context(**context_options)
+    if http_cache is not None:
+        await http_cache.attach(context)
+    # Gắn sau cache để bộ lọc chạy trước (route đăng ký sau được gọi trước).
+    if block_profile is not None:
+        await block_profile.attach(context)
+    return context
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+
+from http_cache import tai_url
+from tracing import tracer, SlotPool
+
+
+def _read_entry(entry):
+    if entry is None:
+        return None
+    path, content_type = entry
+    try:
+        with open(path, 'rb') as f:
+            return f.read(), content_type
+    except OSError:
+        return None
+
+
+class ImagePrefetcher:
+    """
+    Downloads chapter images in the background while scraping is still running,
+    so the exporters (EPUB/PDF) find the bytes already on local disk.
+
+    - submit(urls): schedules downloads, each URL at most once.
+    - drain(): waits for every scheduled download to finish.
+    - get(url): returns (content, content_type) or None if the image is not available.
+
+    Downloads go through `http_cache` (an HttpCache) when one is given.
+    """
+
+    def __init__(self, max_concurrency=8, store_dir=None, timeout=30, http_cache=None):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._slots = SlotPool(max_concurrency, base=1001, label="image")
+        self._owns_store = store_dir is None
+        self.store_dir = store_dir or tempfile.mkdtemp(prefix="valvrare_images_")
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.timeout = timeout
+        self.http_cache = http_cache
+        self._tasks = {}
+        self._index = {}
+        self.failed = 0
+
+    def _download(self, url):
+        content, content_type = tai_url(url, self.http_cache, timeout=self.timeout)
+        path = os.path.join(self.store_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path, content_type
+
+    async def _fetch(self, url):
+        async with self._semaphore:
+            slot = self._slots.acquire()
+            try:
+                with tracer.span("image_fetch", "image", url=url, prefetched=True):
+                    loop = asyncio.get_running_loop()
+                    self._index[url] = await loop.run_in_executor(None, self._download, url)
+            except Exception:
+                # Exporter sẽ tự tải lại và in cảnh báo như bình thường.
+                self.failed += 1
+            finally:
+                self._slots.release(slot)
+
+    def submit(self, urls):
+        for url in urls:
+            if url in self._tasks or not url.startswith(('http://', 'https://')):
+                continue
+            self._tasks[url] = asyncio.create_task(self._fetch(url))
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values())
+
+    def get(self, url):
+        return _read_entry(self._index.get(url))
+
+    def snapshot(self):
+        """Returns {url: (path, content_type)} of finished downloads, for worker processes."""
+        return dict(self._index)
+
+    @property
+    def done(self):
+        return len(self._index)
+
+    def close(self):
+        if self._owns_store:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+
+
+class LocalImageStore:
+    """Read-only view over an ImagePrefetcher snapshot, usable in other processes."""
+
+    def __init__(self, index):
+        self._index = index
+
+    def get(self, url):
+        return _read_entry(self._index.get(url))
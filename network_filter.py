@@ -0,0 +1,87 @@
+from fnmatch import fnmatch
+
+# Các dịch vụ quảng cáo/thống kê thường gặp, không cần thiết cho việc lấy nội dung chương.
+TRACKER_PATTERNS = [
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googlesyndication.com',
+    'doubleclick.net',
+    'adservice.google.',
+    'connect.facebook.net',
+    'facebook.com/tr',
+    'static.cloudflareinsights.com',
+    'hotjar.com',
+    'clarity.ms',
+]
+
+# Các profile có sẵn: loại tài nguyên bị chặn và mẫu URL bị chặn.
+BLOCK_PROFILES = {
+    'none': {'resource_types': set(), 'deny': []},
+    'trackers': {'resource_types': set(), 'deny': TRACKER_PATTERNS},
+    # Chỉ cần thuộc tính `src` của ảnh, nên không cần tải ảnh, font hay media.
+    'scrape': {'resource_types': {'image', 'media', 'font'}, 'deny': TRACKER_PATTERNS},
+}
+
+
+def _match(url, pattern):
+    """A pattern is a glob when it contains wildcards, otherwise a plain substring."""
+    if any(ch in pattern for ch in '*?['):
+        return fnmatch(url, pattern)
+    return pattern in url
+
+
+class BlockProfile:
+    """
+    Allow/deny rules applied to every request of a browser context.
+
+    A request is blocked when its resource type is in `resource_types` or its URL matches
+    one of `deny` patterns, unless it matches one of `allow` patterns. The top-level
+    document is never blocked.
+    """
+
+    def __init__(self, resource_types=None, deny=None, allow=None):
+        self.resource_types = set(resource_types or ())
+        self.deny = list(deny or ())
+        self.allow = list(allow or ())
+        self.blocked = 0
+
+    @classmethod
+    def from_name(cls, name, extra_types=None, extra_deny=None, allow=None):
+        """Builds a profile from BLOCK_PROFILES plus user supplied rules."""
+        base = BLOCK_PROFILES.get(name, BLOCK_PROFILES['none'])
+        return cls(
+            resource_types=base['resource_types'] | set(extra_types or ()),
+            deny=base['deny'] + list(extra_deny or ()),
+            allow=allow
+        )
+
+    @property
+    def is_empty(self):
+        return not self.resource_types and not self.deny
+
+    def should_block(self, url, resource_type):
+        if resource_type == 'document':
+            return False
+        if any(_match(url, pattern) for pattern in self.allow):
+            return False
+        if resource_type in self.resource_types:
+            return True
+        return any(_match(url, pattern) for pattern in self.deny)
+
+    async def _handle_route(self, route, request):
+        if self.should_block(request.url, request.resource_type):
+            self.blocked += 1
+            await route.abort('blockedbyclient')
+            return
+        # Chuyển cho handler đăng ký trước đó (ví dụ HttpCache) hoặc ra mạng.
+        await route.fallback()
+
+    async def attach(self, context):
+        """
+        Installs the filter on a Playwright BrowserContext (or Page). Attach it after
+        HttpCache: the route registered last runs first, so blocked requests never
+        reach the cache or the network.
+        """
+        if not self.is_empty:
+            await context.route("**/*", self._handle_route)
+        return context
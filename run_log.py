@@ -0,0 +1,120 @@
+import collections
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Logger chung của scraper; các module con ghi vào đây thay vì print từng dòng.
+logger = logging.getLogger("valvrare")
+
+
+def item(level, event, message, **fields):
+    """
+    Logs a per-item event (one chapter, image or exported file). It always goes to
+    the JSON-lines log file; the console only shows it when it is an error, or in
+    verbose mode, so thousand-chapter runs keep a readable terminal.
+    """
+    logger.log(level, message, extra={'event': event, 'fields': fields})
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record: time, level, event name, message and the event's fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'event': getattr(record, 'event', None),
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ConsoleFilter(logging.Filter):
+    def __init__(self, verbose):
+        super().__init__()
+        self.verbose = verbose
+
+    def filter(self, record):
+        if getattr(record, 'event', None) is None or self.verbose:
+            return True
+        return record.levelno >= logging.ERROR
+
+
+class _ConsoleHandler(logging.StreamHandler):
+    """Writes to the current sys.stdout, so output goes through alive_bar's hook while a bar is shown."""
+
+    def emit(self, record):
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+class _EventCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.counts = collections.Counter()
+
+    def emit(self, record):
+        event = getattr(record, 'event', None)
+        if event is not None:
+            self.counts[event] += 1
+
+
+class RunLog:
+    """
+    Level-based logging for one run. Records are handed to a queue and written by a
+    background thread (QueueListener), so the scrape and export hot paths never
+    block on a slow terminal or disk.
+
+    - log_file: path of the JSON-lines file receiving every record, or None.
+    - quiet: the console only shows warnings and errors.
+    - verbose: the console also shows per-item events.
+
+    `counts` holds the number of records per event name, for aggregate summaries.
+    """
+
+    def __init__(self, log_file=None, quiet=False, verbose=False):
+        self.log_file = log_file
+        self._queue = queue.Queue(-1)
+        console = _ConsoleHandler()
+        console.setLevel(logging.DEBUG if verbose else logging.WARNING if quiet else logging.INFO)
+        console.addFilter(_ConsoleFilter(verbose))
+        console.setFormatter(logging.Formatter("%(message)s"))
+        handlers = [console]
+        if log_file:
+            file_handler = logging.FileHandler(log_file, encoding='utf-8')
+            file_handler.setLevel(logging.DEBUG)
+            file_handler.setFormatter(JsonLinesFormatter())
+            handlers.append(file_handler)
+        self._handlers = handlers
+        self._listener = logging.handlers.QueueListener(self._queue, *handlers, respect_handler_level=True)
+        self._counter = _EventCounter()
+        self.counts = self._counter.counts
+
+    def start(self):
+        logger.handlers = [logging.handlers.QueueHandler(self._queue), self._counter]
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        self._listener.start()
+        return self
+
+    def stop(self):
+        """Flushes every queued record and closes the log file."""
+        logger.handlers = []
+        logger.propagate = True
+        self._listener.stop()
+        for handler in self._handlers:
+            handler.close()
+
+
+def detach():
+    """
+    Drops the handlers inherited by a worker process: the parent's queue is not
+    drained there, so records fall back to logging's default stderr output instead.
+    """
+    logger.handlers = []
+    logger.propagate = True
@@ -0,0 +1,130 @@
+import asyncio
+import bisect
+import logging
+
+from tracing import tracer, SlotPool, current_slot
+from run_log import item as log_item
+
+
+class LatencyTracker:
+    """Keeps the sorted latencies (seconds) of finished chapters to answer percentile queries."""
+
+    def __init__(self):
+        self._samples = []
+
+    def add(self, seconds):
+        bisect.insort(self._samples, seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p):
+        """p in [0, 1]; returns None when there are no samples yet."""
+        if not self._samples:
+            return None
+        index = min(len(self._samples) - 1, int(p * len(self._samples)))
+        return self._samples[index]
+
+
+class HedgedScheduler:
+    """
+    Runs chapter scrapes with hedged requests to cut tail latency.
+
+    Once a chapter has been running longer than the `percentile` of the latencies
+    observed so far, a duplicate attempt is started on another page; the first attempt
+    that returns content wins and the other one is cancelled. Hedges are limited by
+    their own budget (`max_hedges` in flight) so they never multiply the load.
+
+    - scrape: async callable (context, url) -> content or None.
+    - percentile: e.g. 0.95; 0 or None disables hedging.
+    - min_samples: no hedging until this many chapters have finished.
+    - min_delay: never hedge before this many seconds.
+    """
+
+    def __init__(self, scrape, percentile=0.95, max_hedges=1, min_samples=8, min_delay=2.0):
+        self.scrape = scrape
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = LatencyTracker()
+        self._hedge_slots = asyncio.Semaphore(max(1, max_hedges))
+        self._hedge_lanes = SlotPool(max(1, max_hedges), base=2001, label="hedge")
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self):
+        if not self.percentile or len(self.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latencies.percentile(self.percentile))
+
+    async def _safe_scrape(self, context, url):
+        try:
+            return await self.scrape(context, url)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_item(logging.WARNING, "scrape_error", f"Lỗi khi scraping {url}: {e}", url=url, error=type(e).__name__)
+            return None
+
+    async def _hedge_scrape(self, context, url, lane):
+        # Lần thử dự phòng có làn riêng trong trace, không chồng lên slot của lần thử chính.
+        current_slot.set(lane)
+        return await self._safe_scrape(context, url)
+
+    @staticmethod
+    async def _huy_lan_thu(attempts):
+        """Cancels the attempts still running and waits until they have fully unwound (pages closed)."""
+        for attempt in attempts:
+            if not attempt.done():
+                attempt.cancel()
+        await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def run(self, context, url):
+        """Scrapes one chapter, hedging it if it turns into a straggler."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        primary = asyncio.ensure_future(self._safe_scrape(context, url))
+        attempts = [primary]
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and not self._hedge_slots.locked():
+                    async with self._hedge_slots:
+                        # Làn được giữ đến khi kẻ thua kết thúc hẳn, rồi mới nhả cùng với semaphore.
+                        lane = self._hedge_lanes.acquire(bind=False)
+                        try:
+                            self.hedged += 1
+                            tracer.instant("hedge", "scheduler", url=url, delay=delay)
+                            hedge = asyncio.ensure_future(self._hedge_scrape(context, url, lane))
+                            attempts.append(hedge)
+                            try:
+                                content, winner = await self._first_success(attempts)
+                            finally:
+                                await self._huy_lan_thu(attempts)
+                            if winner is hedge:
+                                self.hedge_wins += 1
+                            if content:
+                                self.latencies.add(loop.time() - start)
+                            return content
+                        finally:
+                            self._hedge_lanes.release(lane, bind=False)
+            content = await primary
+            if content:
+                self.latencies.add(loop.time() - start)
+            return content
+        finally:
+            # Hủy (và chờ) các lần thử còn lại nếu chính tác vụ này bị hủy.
+            await self._huy_lan_thu(attempts)
+
+    @staticmethod
+    async def _first_success(attempts):
+        """Waits until one attempt returns content; returns (content, attempt) or (None, None)."""
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                content = attempt.result()
+                if content:
+                    return content, attempt
+        return None, None
@@ -1,22 +1,28 @@
 import asyncio
-import json
+import functools
 import os
 import time
 import requests
 from io import BytesIO
-from playwright.async_api import async_playwright
-from ebooklib import epub
-from bs4 import BeautifulSoup
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from PIL import Image as PILImage
 from tao_so_do_cay import get_chapter_tree, get_chapter_tree_list, get_chapters_by_volume_index , get_chapter_tree_folder
-from alive_progress import alive_bar
-from simple_term_menu import TerminalMenu
+from http_cache import HttpCache, tao_context, tai_url
+from network_filter import BlockProfile, BLOCK_PROFILES
+from image_prefetch import ImagePrefetcher, LocalImageStore
+from tracing import tracer, traced, SlotPool, ExportProfiler, current_task
+from archive_output import OutputArchive
+from epub_update import EpubInfo, them_chuong_epub
+from scheduler import HedgedScheduler
+from run_log import RunLog, logger, item as log_item
+from failure_ledger import FailureLedger
+import run_log
+import logging
 import re
+import textwrap
+from xml.sax.saxutils import escape as xml_escape
+
+# Các thư viện nặng (playwright, ebooklib, reportlab, PIL, bs4, alive_progress,
+# simple_term_menu) được import ngay trong hàm cần đến chúng, để một lần chạy
+# chỉ xuất TXT hoặc gõ sai tên truyện không phải trả thời gian import toàn bộ.
 
 def sanitize_filename(name):
     """
@@ -30,12 +36,62 @@ def sanitize_filename(name):
     sanitized_name = re.sub(r'\s+', ' ', sanitized_name).strip()
     return sanitized_name
 
-skipped_urls = []
+# Các file không tạo được của lần chạy. main() thay bằng sổ ghi trong thư mục đầu ra (cũng
+# nhận lỗi tải chương) để --retry-failed có thể thử lại đúng các mục này.
+failure_ledger = FailureLedger()
+# Mục 'export' đặc biệt: giai đoạn tạo file chưa chạy xong, lần thử lại phải tạo lại mọi file.
+TAT_CA_FILE = '*'
 MAX_RETRIES = 2
+# Được gán trong main() khi có xuất EPUB/PDF; các exporter lấy ảnh từ đây nếu đã tải trước.
+image_prefetcher = None
+
+# Bộ nhớ đệm HTTP của lần chạy (gán trong main()); ảnh tải ngoài trình duyệt cũng đi qua đây.
+shared_http_cache = None
+
+# Được gán trong main() khi chọn --archive; các exporter ghi kết quả vào đây thay vì tạo file lẻ.
+output_archive = None
+
+# RunLog của lần chạy, được gán trong main() và dừng (ghi hết hàng đợi) khi chương trình kết thúc.
+nhat_ky = None
+
+def ghi_ket_qua(filename, data):
+    """Writes the bytes of an exported file, into the active output archive if there is one."""
+    if output_archive is not None:
+        output_archive.add(filename, data)
+        return
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def luu_so_loi():
+    """
+    Saves the run's failure ledger (no-op before main() has set one up). Chapters of
+    the selection that were neither collected nor recorded, because the run stopped
+    before reaching them, are recorded first so --retry-failed picks them up.
+    """
+    if failure_ledger.path is None:
+        return
+    for url in failure_ledger.run.get('chapter_urls', []):
+        if url not in failure_ledger.content and not failure_ledger.has(url, 'scrape'):
+            failure_ledger.record(url, 'scrape', "Interrupted", "lần chạy dừng trước khi tải chương này")
+    failure_ledger.save()
+
+def tai_anh(img_url):
+    """
+    Returns (content, content_type) of an image, from the prefetch store when it is
+    already there, otherwise by downloading it directly.
+    """
+    if image_prefetcher is not None:
+        cached = image_prefetcher.get(img_url)
+        if cached is not None:
+            return cached
+    with tracer.span("image_fetch", "image", url=img_url, prefetched=False):
+        return tai_url(img_url, shared_http_cache, timeout=30)
 
-async def lay_thong_tin_truyen(browser, ten_truyen):
+async def lay_thong_tin_truyen(browser, ten_truyen, cover_dir=".", http_cache=None):
     """
     Scrapes basic information about the story from its main page. Such as title, author, description and cover image.
+    The cover is saved as `cover.jpg` inside `cover_dir` (the run's own folder, never a shared path),
+    downloaded through `http_cache` when one is given.
     """
     page = await browser.new_page()
     url = f"https://valvrareteam.net/{ten_truyen}"
@@ -52,56 +108,118 @@ async def lay_thong_tin_truyen(browser, ten_truyen):
     # download cover image 
     
     image_url = await page.locator("img.rd-cover-image").get_attribute("src")
+    cover_path = None
     if image_url:
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            cover_path = "cover.jpg"
-            print(f"Đang tải ảnh bìa về: {cover_path}")
+        try:
+            cover_content, _ = tai_url(image_url, http_cache)
+        except Exception:
+            cover_content = None
+        if cover_content is not None:
+            cover_path = os.path.join(cover_dir, "cover.jpg")
+            logger.info(f"Đang tải ảnh bìa về: {cover_path}")
             with open(cover_path, "wb") as f:
-                f.write(response.content)
+                f.write(cover_content)
     await page.close()
-    return {"title": title.strip(), "author": author.strip(), "description": description.strip(), cover_path: cover_path
+    return {"title": title.strip(), "author": author.strip(), "description": description.strip(), "cover_path": cover_path
     }
 
-async def lay_chuong_voi_hinh_anh(browser, url):
+async def lay_chuong_voi_hinh_anh(browser, url, failure_ledger=None):
     """
     Scrapes a single chapter page for text and images using Playwright.
-    Retries on failure.
+    Retries on failure; each failed attempt is recorded in `failure_ledger` if given.
     """
     page = await browser.new_page()
+    try:
+        return await _scrape_trang_chuong(page, url, failure_ledger)
+    finally:
+        # Đóng trang cả khi tác vụ bị hủy (ví dụ lần thử dự phòng thua cuộc).
+        await page.close()
+
+async def _scrape_trang_chuong(page, url, failure_ledger=None):
     for attempt in range(MAX_RETRIES):
         try:
-            await page.goto(url, wait_until='domcontentloaded', timeout=60000)
+            with tracer.span("navigation", "scrape", url=url, attempt=attempt + 1):
+                await page.goto(url, wait_until='domcontentloaded', timeout=60000)
             content_selector = ".chapter-card p, .chapter-card img"
-            await page.wait_for_selector(content_selector, timeout=30000)
-            elements = page.locator(content_selector)
-            extracted_content = []
-            for i in range(await elements.count()):
-                element = elements.nth(i)
-                tag_name = await element.evaluate('el => el.tagName')
-                if tag_name == 'IMG':
-                    image_url = await element.get_attribute('src')
-                    if image_url:
-                        extracted_content.append({'type': 'image', 'data': image_url})
-                elif tag_name == 'P':
-                    text = await element.inner_text()
-                    if text.strip():
-                        extracted_content.append({'type': 'text', 'data': text.strip()})
-            await page.close()
+            with tracer.span("selector_wait", "scrape", url=url, attempt=attempt + 1):
+                await page.wait_for_selector(content_selector, timeout=30000)
+            with tracer.span("extraction", "scrape", url=url) as span:
+                elements = page.locator(content_selector)
+                extracted_content = []
+                for i in range(await elements.count()):
+                    element = elements.nth(i)
+                    tag_name = await element.evaluate('el => el.tagName')
+                    if tag_name == 'IMG':
+                        image_url = await element.get_attribute('src')
+                        if image_url:
+                            extracted_content.append({'type': 'image', 'data': image_url})
+                    elif tag_name == 'P':
+                        text = await element.inner_text()
+                        if text.strip():
+                            extracted_content.append({'type': 'text', 'data': text.strip()})
+                span.set(items=len(extracted_content))
             return extracted_content
         except Exception as e:
-            print(f"Lỗi lần {attempt + 1}/{MAX_RETRIES} khi scraping {url}: {e}")
+            tracer.instant("retry", "scrape", url=url, attempt=attempt + 1, error=str(e))
+            if failure_ledger is not None:
+                failure_ledger.record(url, 'scrape', e)
             if attempt < MAX_RETRIES - 1:
-                print("Đang thử lại sau 5 giây...")
-                await asyncio.sleep(5)
+                log_item(logging.WARNING, "scrape_retry", f"Lỗi lần {attempt + 1}/{MAX_RETRIES} khi scraping {url}: {e}. Thử lại sau 5 giây...",
+                         url=url, attempt=attempt + 1, error=type(e).__name__)
+                with tracer.span("retry_wait", "scrape", url=url):
+                    await asyncio.sleep(5)
             else:
-                print(f"Bỏ qua URL {url} sau {MAX_RETRIES} lần thử thất bại.")
+                log_item(logging.WARNING, "scrape_failed", f"Bỏ qua URL {url} sau {MAX_RETRIES} lần thử thất bại: {e}",
+                         url=url, attempt=attempt + 1, error=type(e).__name__)
 
-    await page.close()
     return None
 
 # --- CÁC HÀM XUẤT FILE ---
 
+def _html_chuong_epub(chap_title, content, image_counter):
+    """
+    Builds the XHTML body of one EPUB chapter and downloads its images.
+    Returns (html, [(image file name, media type, bytes)], next image counter).
+    Image files are numbered from `image_counter` and referenced as `images/<name>`.
+    """
+    html_content = f'<h1>{xml_escape(chap_title)}</h1>'
+    images = []
+    for item in content:
+        if item['type'] == 'text':
+            html_content += f'<p>{xml_escape(item["data"])}</p>'
+        elif item['type'] == 'image':
+            try:
+                img_url = item["data"]
+                # Basic check for valid image URL
+                if not img_url.startswith(('http://', 'https://')):
+                    raise ValueError("Invalid image URL")
+
+                img_content, content_type = tai_anh(img_url)
+                
+                # Determine image extension
+                img_extension = 'jpg' # default
+                parsed_url = requests.utils.urlparse(img_url)
+                path_parts = parsed_url.path.split('.')
+                if len(path_parts) > 1:
+                    img_extension = path_parts[-1].lower()
+                
+                # Ensure extension is valid for epub
+                if img_extension not in ['jpg', 'jpeg', 'png', 'gif', 'svg']:
+                    # Attempt to get mimetype and decide extension
+                    if 'jpeg' in content_type: img_extension = 'jpg'
+                    elif 'png' in content_type: img_extension = 'png'
+                    #... add other mimetypes if needed
+
+                img_filename = f'image_{image_counter}.{img_extension}'
+                image_counter += 1
+                images.append((img_filename, f'image/{img_extension}', img_content))
+                html_content += f'<img src="images/{img_filename}" alt="Hình minh họa"/>'
+            except Exception as e:
+                log_item(logging.WARNING, "image_failed", f"[Cảnh báo] Không thể tải hoặc xử lý ảnh cho EPUB: {item.get('data', 'N/A')}. Lỗi: {e}",
+                         url=item.get('data'), format="EPUB", error=type(e).__name__)
+    return html_content, images, image_counter
+
+@traced("export")
 def tao_file_epub(filename, book_title, author, chapters_data, description="", cover_path=None):
     """
     Creates a structured EPUB file from a list of chapters, potentially grouped by volumes.
@@ -109,7 +227,19 @@ def tao_file_epub(filename, book_title, author, chapters_data, description="", c
         - Chapter dictionaries: {'title': str, 'content': list}
         - Volume dictionaries: {'volume': str, 'chapters': [list of chapter dictionaries]}
     """
-    print(f"Đang tạo file EPUB: {filename}...")
+    log_item(logging.DEBUG, "export_start", f"Đang tạo file EPUB: {filename}...", file=filename, format="EPUB")
+    try:
+        ghi_ket_qua(filename, _dung_sach_epub(filename, book_title, author, chapters_data, description, cover_path))
+        log_item(logging.INFO, "export_done", f"Tạo file EPUB thành công: {filename}", file=filename, format="EPUB")
+    except Exception as e:
+        failure_ledger.record(filename, 'export', e, format="EPUB")
+        log_item(logging.ERROR, "export_failed", f"!!! LỖI: Không thể tạo file EPUB '{filename}'. Lý do: {e}",
+                 file=filename, format="EPUB", error=type(e).__name__)
+
+def _dung_sach_epub(filename, book_title, author, chapters_data, description, cover_path):
+    """Builds the EPUB described by tao_file_epub's arguments and returns its bytes."""
+    from ebooklib import epub
+
     book = epub.EpubBook()
 
     # --- Set Metadata ---
@@ -119,9 +249,10 @@ def tao_file_epub(filename, book_title, author, chapters_data, description="", c
     book.add_author(author)
     book.add_metadata('DC', 'description', description)
     try:
-        book.set_cover("cover.jpg", open('cover.jpg', 'rb').read())
+        with open(cover_path, 'rb') as f:
+            book.set_cover("cover.jpg", f.read())
     except Exception:
-        print("  [Cảnh báo] Không thể thêm ảnh bìa vào EPUB.")
+        log_item(logging.WARNING, "cover_failed", "[Cảnh báo] Không thể thêm ảnh bìa vào EPUB.", file=filename)
     # --- Process Chapters and Volumes ---
     toc = []
     spine = ['nav']
@@ -133,52 +264,14 @@ def tao_file_epub(filename, book_title, author, chapters_data, description="", c
         chap_filename = f'chap_{chap_idx}.xhtml'
         chapter_obj = epub.EpubHtml(title=chap_title, file_name=chap_filename, lang='vi')
 
-        html_content = f'<h1>{chap_title}</h1>'
-        for item in chap_data.get('content', []):
-            if item['type'] == 'text':
-                html_content += f'<p>{item["data"]}</p>'
-            elif item['type'] == 'image':
-                try:
-                    img_url = item["data"]
-                    # Basic check for valid image URL
-                    if not img_url.startswith(('http://', 'https://')):
-                        raise ValueError("Invalid image URL")
-
-                    response = requests.get(img_url)
-                    response.raise_for_status()
-                    img_content = response.content
-                    
-                    # Determine image extension
-                    img_extension = 'jpg' # default
-                    parsed_url = requests.utils.urlparse(img_url)
-                    path_parts = parsed_url.path.split('.')
-                    if len(path_parts) > 1:
-                        img_extension = path_parts[-1].lower()
-                    
-                    # Ensure extension is valid for epub
-                    if img_extension not in ['jpg', 'jpeg', 'png', 'gif', 'svg']:
-                        # Attempt to get mimetype and decide extension
-                        try:
-                            content_type = response.headers['Content-Type']
-                            if 'jpeg' in content_type: img_extension = 'jpg'
-                            elif 'png' in content_type: img_extension = 'png'
-                            #... add other mimetypes if needed
-                        except (KeyError, IndexError):
-                             img_extension = 'jpg' # fallback
-
-                    img_filename = f'image_{image_counter}.{img_extension}'
-                    image_counter += 1
-
-                    img_item = epub.EpubImage(
-                        uid=os.path.splitext(img_filename)[0],
-                        file_name=f'images/{img_filename}',
-                        media_type=f'image/{img_extension}',
-                        content=img_content
-                    )
-                    book.add_item(img_item)
-                    html_content += f'<img src="images/{img_filename}" alt="Hình minh họa"/>'
-                except Exception as e:
-                    print(f"  [Cảnh báo] Không thể tải hoặc xử lý ảnh cho EPUB: {item.get('data', 'N/A')}. Lỗi: {e}")
+        html_content, images, image_counter = _html_chuong_epub(chap_title, chap_data.get('content', []), image_counter)
+        for img_filename, media_type, img_content in images:
+            book.add_item(epub.EpubImage(
+                uid=os.path.splitext(img_filename)[0],
+                file_name=f'images/{img_filename}',
+                media_type=media_type,
+                content=img_content
+            ))
 
         chapter_obj.content = html_content
         return chapter_obj
@@ -216,23 +309,31 @@ def tao_file_epub(filename, book_title, author, chapters_data, description="", c
     if image_counter > 1 and not any(item.file_name == 'images/' for item in book.items):
          book.add_item(epub.EpubItem(file_name="images/", media_type="application/x-dtbncx+xml"))
 
-    epub.write_epub(filename, book, {})
-    print(f"Tạo file EPUB thành công: {filename}")
+    buffer = BytesIO()
+    epub.write_epub(buffer, book, {})
+    return buffer.getvalue()
 
 
-def tao_file_pdf(content_list, filename, title="Chương truyện", font_name='DejaVuSans'):
-    """Creates a PDF file from a list of content."""
-    print(f"Đang tạo file PDF: {filename}...")
+def _chuan_bi_font_pdf(font_name):
+    """
+    Makes sure the font file exists (downloading it if needed), registers it with
+    ReportLab and returns (style, title_style).
+    """
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
     valid_fonts = ['DejaVuSans', 'NotoSerif']
     if font_name not in valid_fonts:
-        print(f"[Cảnh báo] Font '{font_name}' không hợp lệ. Sử dụng font mặc định 'DejaVuSans'.")
+        logger.warning(f"[Cảnh báo] Font '{font_name}' không hợp lệ. Sử dụng font mặc định 'DejaVuSans'.")
         font_name = 'DejaVuSans'
 
     font_filename_map = {'DejaVuSans': 'DejaVuSans.ttf', 'NotoSerifF': 'NotoSerif-Regular.ttf'}
     font_path = font_filename_map.get(font_name, 'DejaVuSans.ttf')
 
     if not os.path.exists(font_path):
-        print(f"Font '{font_path}' not found. Attempting to download...")
+        logger.info(f"Font '{font_path}' not found. Attempting to download...")
         font_urls = {
             'DejaVuSans': 'https://github.com/dejavu-fonts/dejavu-fonts/raw/master/ttf/DejaVuSans.ttf',
             'NotoSerif': 'https://raw.githubusercontent.com/google/fonts/main/ofl/notoserif/NotoSerif-Regular.ttf'
@@ -240,61 +341,323 @@ def tao_file_pdf(content_list, filename, title="Chương truyện", font_name='D
         url = font_urls.get(font_name)
         if url:
             try:
-                print(f"Downloading from {url}...")
+                logger.info(f"Downloading from {url}...")
                 response = requests.get(url, stream=True)
                 response.raise_for_status()
                 with open(font_path, 'wb') as f: 
                     for chunk in response.iter_content(chunk_size=8192): f.write(chunk)
-                print(f"Font '{font_path}' downloaded successfully.")
+                logger.info(f"Font '{font_path}' downloaded successfully.")
             except Exception as e:
-                print(f"!!! LỖI: Không thể tải font '{font_name}'. Lý do: {e}")
+                log_item(logging.WARNING, "font_failed", f"!!! LỖI: Không thể tải font '{font_name}'. Lý do: {e}",
+                         font=font_name, error=type(e).__name__)
         else:
-            print(f"Không có URL tải xuống cho font '{font_name}'.")
+            logger.error(f"Không có URL tải xuống cho font '{font_name}'.")
 
     try:
         pdfmetrics.registerFont(TTFont(font_name, font_path))
         style = ParagraphStyle(name='Normal_vi', fontName=font_name, fontSize=12, leading=14)
         title_style = ParagraphStyle(name='Title_vi', fontName=font_name, fontSize=18, leading=22, spaceAfter=0.2 * inch)
     except Exception:
-        print(f"[Cảnh báo] Không thể đăng ký font '{font_path}'. Tiếng Việt có thể hiển thị lỗi.")
+        log_item(logging.WARNING, "font_failed", f"[Cảnh báo] Không thể đăng ký font '{font_path}'. Tiếng Việt có thể hiển thị lỗi.",
+                 font=font_name)
         styles = getSampleStyleSheet()
         style = styles['Normal']
         title_style = styles['h1']
+    return style, title_style
 
-    doc = SimpleDocTemplate(filename)
-    story = [Paragraph(title, title_style), Spacer(1, 0.2 * inch)]
-    max_width, max_height = doc.width, doc.height
-    
+# Ký tự điều khiển không hợp lệ trong XML, làm trình phân tích của ReportLab báo lỗi.
+_KY_TU_DIEU_KHIEN = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+
+def lam_sach_van_ban_pdf(text):
+    """
+    Removes control characters and escapes '&', '<', '>' so scraped text is never
+    parsed as ReportLab Paragraph markup.
+    """
+    return xml_escape(_KY_TU_DIEU_KHIEN.sub('', text))
+
+def _khoi_du_phong_pdf(text, style, max_width):
+    """Plain-text block (no markup parsing) used for elements that fail layout."""
+    from reportlab.platypus import Preformatted
+
+    chars_per_line = max(20, int(max_width / (style.fontSize * 0.55)))
+    return Preformatted(textwrap.fill(_KY_TU_DIEU_KHIEN.sub('', text), chars_per_line), style)
+
+def _doan_van_pdf(text, style, max_width):
+    """A Paragraph for the (escaped) text, or a plain-text block if it cannot be parsed."""
+    from reportlab.platypus import Paragraph
+
+    try:
+        p = Paragraph(lam_sach_van_ban_pdf(text), style)
+    except Exception:
+        p = _khoi_du_phong_pdf(text, style, max_width)
+    # Giữ lại văn bản gốc để có thể thay bằng khối dự phòng nếu dàn trang lỗi.
+    p.van_ban_goc = text
+    return p
+
+def _dung_pdf_an_toan(story, style):
+    """
+    Builds a PDF from flowables and returns (pdf bytes, number of quarantined elements).
+    If the build fails, each element is checked against the frame on its own; only
+    those that cannot be laid out (wrap raises, too wide, or too tall and unsplittable)
+    are replaced by plain-text blocks and the document is rebuilt once.
+    """
+    from reportlab.platypus import SimpleDocTemplate
+
+    buffer = BytesIO()
+    try:
+        SimpleDocTemplate(buffer).build(list(story))
+        return buffer.getvalue(), 0
+    except Exception as e:
+        first_error = e
+
+    frame_width, frame_height = _kich_thuoc_trang_pdf()
+
+    def dan_trang_duoc(flowable):
+        try:
+            width, height = flowable.wrap(frame_width, frame_height)
+            if width > frame_width + 1e-6:
+                return False
+            return height <= frame_height + 1e-6 or bool(flowable.split(frame_width, frame_height))
+        except Exception:
+            return False
+
+    safe_story, quarantined = [], 0
+    for flowable in story:
+        if hasattr(flowable, 'van_ban_goc') and not dan_trang_duoc(flowable):
+            flowable = _khoi_du_phong_pdf(flowable.van_ban_goc, style, frame_width)
+            quarantined += 1
+        safe_story.append(flowable)
+    if not quarantined:
+        raise first_error
+    buffer = BytesIO()
+    SimpleDocTemplate(buffer).build(safe_story)
+    return buffer.getvalue(), quarantined
+
+# Lề trong mặc định của Frame (6pt mỗi cạnh) mà SimpleDocTemplate dùng cho mỗi trang.
+_LE_TRONG_KHUNG_PDF = 6
+
+def _kich_thuoc_trang_pdf():
+    """(width, height) available to flowables inside the frame of a default SimpleDocTemplate page."""
+    from reportlab.platypus import SimpleDocTemplate
+
+    doc = SimpleDocTemplate(BytesIO())
+    return doc.width - 2 * _LE_TRONG_KHUNG_PDF, doc.height - 2 * _LE_TRONG_KHUNG_PDF
+
+def _tao_noi_dung_pdf(content_list, style, max_width, max_height):
+    """Turns a content list into ReportLab flowables (paragraphs and scaled images)."""
+    from reportlab.platypus import Spacer, Image
+    from reportlab.lib.units import inch
+    from PIL import Image as PILImage
+
+    story = []
     for item in content_list:
         if item['type'] == 'text':
-            p = Paragraph(item['data'], style)
+            p = _doan_van_pdf(item['data'], style, max_width)
             story.append(p)
             story.append(Spacer(1, 0.1 * inch))
         elif item['type'] == 'image':
             try:
-                response = requests.get(item['data'])
-                response.raise_for_status()
-                pil_img = PILImage.open(BytesIO(response.content))
+                img_content, _ = tai_anh(item['data'])
+                pil_img = PILImage.open(BytesIO(img_content))
                 img_width, img_height = pil_img.size
                 scale_ratio = min(max_width / img_width, max_height / img_height, 1)
                 new_width = img_width * scale_ratio
                 new_height = img_height * scale_ratio
-                img = Image(BytesIO(response.content), width=new_width, height=new_height)
+                img = Image(BytesIO(img_content), width=new_width, height=new_height)
+                img.van_ban_goc = f"[Hình minh họa: {item['data']}]"
                 story.append(img)
                 story.append(Spacer(1, 0.1 * inch))
             except Exception as e:
-                print(f"  [Cảnh báo] Không thể tải hoặc xử lý ảnh cho PDF: {item['data']}. Lỗi: {e}")
+                log_item(logging.WARNING, "image_failed", f"[Cảnh báo] Không thể tải hoặc xử lý ảnh cho PDF: {item['data']}. Lỗi: {e}",
+                         url=item['data'], format="PDF", error=type(e).__name__)
+    return story
 
+def _doc_epub(path):
+    """
+    EpubInfo of an existing EPUB, or None (with a warning) when it cannot be read,
+    e.g. a file truncated by an interrupted write; such a volume is rebuilt in full.
+    """
     try:
-        doc.build(story)
-        print(f"Tạo file PDF thành công: {filename}")
+        return EpubInfo(path)
     except Exception as e:
-        skipped_urls.append(filename + f" (Lỗi PDF: {e})")
-        print(f"!!! LỖI NGHIÊM TRỌNG: Không thể tạo file PDF '{filename}'. Lý do: {e}")
+        logger.warning(f"[Cảnh báo] Không đọc được file EPUB '{path}', sẽ tạo lại cả tập. Lý do: {e}")
+        return None
+
+@traced("export")
+def cap_nhat_file_epub(filename, chapters_data):
+    """
+    Appends to an existing EPUB (made by tao_file_epub) the chapters whose titles it
+    does not contain yet. Untouched entries are copied without recompression; only the
+    OPF spine/manifest, nav and NCX are rewritten. Returns the number of chapters added.
+    - chapters_data: [{'title': str, 'content': list}]
+    """
+    log_item(logging.DEBUG, "export_start", f"Đang cập nhật file EPUB: {filename}...", file=filename, format="EPUB")
+    try:
+        info = EpubInfo(filename)
+        co_san = set(info.chapter_titles)
+        new_chapters = [chap for chap in chapters_data if chap['title'] not in co_san]
+        if not new_chapters:
+            log_item(logging.INFO, "export_done", f"File EPUB đã đầy đủ, không có chương mới: {filename}", file=filename, format="EPUB", added=0)
+            return 0
+
+        image_counter = info.next_image
+        chapters, images = [], []
+        for chap in new_chapters:
+            body, chap_images, image_counter = _html_chuong_epub(chap['title'], chap['content'], image_counter)
+            chapters.append((chap['title'], body))
+            images.extend(chap_images)
+        them_chuong_epub(info, chapters, images)
+    except Exception as e:
+        failure_ledger.record(filename, 'export', e, format="EPUB")
+        log_item(logging.ERROR, "export_failed", f"!!! LỖI: Không thể cập nhật file EPUB '{filename}'. Lý do: {e}",
+                 file=filename, format="EPUB", error=type(e).__name__)
+        return 0
+    log_item(logging.INFO, "export_done", f"Đã thêm {len(new_chapters)} chương mới vào EPUB: {filename}",
+             file=filename, format="EPUB", added=len(new_chapters))
+    return len(new_chapters)
+
+@traced("export")
+def tao_file_pdf(content_list, filename, title="Chương truyện", font_name='DejaVuSans'):
+    """Creates a PDF file from a list of content."""
+    from reportlab.platypus import Spacer
+    from reportlab.lib.units import inch
+
+    log_item(logging.DEBUG, "export_start", f"Đang tạo file PDF: {filename}...", file=filename, format="PDF")
+    style, title_style = _chuan_bi_font_pdf(font_name)
+
+    max_width, max_height = _kich_thuoc_trang_pdf()
+    story = [_doan_van_pdf(title, title_style, max_width), Spacer(1, 0.2 * inch)]
+    story.extend(_tao_noi_dung_pdf(content_list, style, max_width, max_height))
+
+    try:
+        pdf_bytes, quarantined = _dung_pdf_an_toan(story, style)
+        if quarantined:
+            log_item(logging.WARNING, "pdf_quarantine", f"[Cảnh báo] {quarantined} đoạn không dàn trang được, đã in dạng văn bản thô trong '{filename}'.",
+                     file=filename, paragraphs=quarantined)
+        ghi_ket_qua(filename, pdf_bytes)
+        log_item(logging.INFO, "export_done", f"Tạo file PDF thành công: {filename}", file=filename, format="PDF")
+    except Exception as e:
+        failure_ledger.record(filename, 'export', e, format="PDF")
+        log_item(logging.ERROR, "export_failed", f"!!! LỖI NGHIÊM TRỌNG: Không thể tạo file PDF '{filename}'. Lý do: {e}",
+                 file=filename, format="PDF", error=type(e).__name__)
+
+def _khoi_tao_worker_pdf(anh_da_tai, http_cache=None):
+    """Initializer of PDF worker processes: exposes the parent's prefetched images and HTTP cache."""
+    global image_prefetcher, shared_http_cache
+    image_prefetcher = LocalImageStore(anh_da_tai) if anh_da_tai else None
+    shared_http_cache = http_cache
+    run_log.detach()
+
+def _tao_phan_pdf(volume_title, chapters, font_name, story_title=None):
+    """
+    Builds the PDF of one volume in memory. Returns (pdf bytes, [(chapter title,
+    0-based page index)]) so the merged file can bookmark every chapter.
+    Runs in a worker process when the build is parallel.
+    """
+    from reportlab.platypus import Spacer, Flowable
+    from reportlab.lib.units import inch
+
+    class DanhDauChuong(Flowable):
+        """Zero-size flowable recording the page a chapter starts on."""
+        def __init__(self, index, chapter_title, pages):
+            super().__init__()
+            self.index = index
+            self.chapter_title = chapter_title
+            self.pages = pages
+
+        def wrap(self, available_width, available_height):
+            return 0, 0
+
+        def draw(self):
+            # Ghi theo chỉ số: nếu tài liệu được dựng lại, lần vẽ sau ghi đè lần trước.
+            self.pages[self.index] = (self.chapter_title, self.canv.getPageNumber() - 1)
+
+    style, title_style = _chuan_bi_font_pdf(font_name)
+    max_width, max_height = _kich_thuoc_trang_pdf()
+    chapter_pages = {}
+    story = []
+    if story_title:
+        story.append(_doan_van_pdf(story_title, title_style, max_width))
+    story += [_doan_van_pdf(volume_title, title_style, max_width), Spacer(1, 0.2 * inch)]
+    for i, chap in enumerate(chapters):
+        story.append(DanhDauChuong(i, chap['title'], chapter_pages))
+        story.extend(_tao_noi_dung_pdf(chap['content'], style, max_width, max_height))
+    pdf_bytes, quarantined = _dung_pdf_an_toan(story, style)
+    if quarantined:
+        log_item(logging.WARNING, "pdf_quarantine", f"[Cảnh báo] {quarantined} đoạn của tập '{volume_title}' đã in dạng văn bản thô.",
+                 volume=volume_title, paragraphs=quarantined)
+    return pdf_bytes, [chapter_pages[i] for i in sorted(chapter_pages)]
+
+@traced("export")
+def tao_file_pdf_theo_tap(story_structure, filename, title="Truyện", font_name='DejaVuSans', workers=1):
+    """
+    Creates a whole-story PDF by building each volume as an independent part
+    (in `workers` processes when > 1) and merging the parts into one file with
+    a bookmark per volume and per chapter. A volume that fails to build is
+    recorded in failure_ledger and left out; the other volumes are still merged.
+    - story_structure: [{'volume': str, 'chapters': [{'title': str, 'content': list}]}]
+    """
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        logger.warning("[Cảnh báo] Chưa cài 'pypdf', tạo PDF một khối như cũ.")
+        tao_file_pdf([item for vol in story_structure for chap in vol['chapters'] for item in chap['content']],
+                     filename, title, font_name)
+        return
 
+    log_item(logging.DEBUG, "export_start", f"Đang tạo file PDF theo từng tập ({len(story_structure)} phần): {filename}...",
+             file=filename, format="PDF", parts=len(story_structure))
+    _chuan_bi_font_pdf(font_name)  # Tải font một lần trước khi các tiến trình con dùng đến.
+
+    jobs = [(vol['volume'], vol['chapters'], font_name, title if i == 0 else None)
+            for i, vol in enumerate(story_structure)]
+    parts = [None] * len(jobs)
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        anh_da_tai = image_prefetcher.snapshot() if image_prefetcher is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=_khoi_tao_worker_pdf, initargs=(anh_da_tai, shared_http_cache)) as pool:
+            futures = [pool.submit(_tao_phan_pdf, *job) for job in jobs]
+            for i, future in enumerate(futures):
+                try:
+                    parts[i] = future.result()
+                except Exception as e:
+                    parts[i] = e
+    else:
+        for i, job in enumerate(jobs):
+            try:
+                parts[i] = _tao_phan_pdf(*job)
+            except Exception as e:
+                parts[i] = e
+
+    writer = PdfWriter()
+    for (volume_title, *_), part in zip(jobs, parts):
+        if isinstance(part, Exception):
+            failure_ledger.record(filename, 'export', part, format="PDF", volume=volume_title)
+            log_item(logging.ERROR, "export_failed", f"!!! LỖI: Không thể tạo phần PDF của tập '{volume_title}'. Lý do: {part}",
+                     file=filename, format="PDF", volume=volume_title, error=type(part).__name__)
+            continue
+        pdf_bytes, chapter_pages = part
+        offset = len(writer.pages)
+        for page in PdfReader(BytesIO(pdf_bytes)).pages:
+            writer.add_page(page)
+        volume_bookmark = writer.add_outline_item(volume_title, offset)
+        for chapter_title, page_index in chapter_pages:
+            writer.add_outline_item(chapter_title, offset + page_index, parent=volume_bookmark)
+
+    if not writer.pages:
+        failure_ledger.record(filename, 'export', "NoPdfPart", "không có phần nào tạo được", format="PDF")
+        log_item(logging.ERROR, "export_failed", f"!!! LỖI NGHIÊM TRỌNG: Không thể tạo file PDF '{filename}'.",
+                 file=filename, format="PDF")
+        return
+    buffer = BytesIO()
+    writer.write(buffer)
+    ghi_ket_qua(filename, buffer.getvalue())
+    log_item(logging.INFO, "export_done", f"Tạo file PDF thành công: {filename}", file=filename, format="PDF")
+
+@traced("export")
 def tao_file_html(content_list, filename, title="Chương truyện"):
     """Creates an HTML file from a list of content."""
-    print(f"Đang tạo file HTML: {filename}...")
+    log_item(logging.DEBUG, "export_start", f"Đang tạo file HTML: {filename}...", file=filename, format="HTML")
     html_content = f"""
 <!DOCTYPE html>
 <html lang="vi">
@@ -321,15 +684,17 @@ def tao_file_html(content_list, filename, title="Chương truyện"):
     html_content += "</body>\n</html>"
     
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        print(f"Tạo file HTML thành công: {filename}")
+        ghi_ket_qua(filename, html_content.encode('utf-8'))
+        log_item(logging.INFO, "export_done", f"Tạo file HTML thành công: {filename}", file=filename, format="HTML")
     except Exception as e:
-        print(f"!!! LỖI: Không thể tạo file HTML '{filename}'. Lý do: {e}")
+        failure_ledger.record(filename, 'export', e, format="HTML")
+        log_item(logging.ERROR, "export_failed", f"!!! LỖI: Không thể tạo file HTML '{filename}'. Lý do: {e}",
+                 file=filename, format="HTML", error=type(e).__name__)
 
+@traced("export")
 def tao_file_md(content_list, filename, title="Chương truyện"):
     """Creates a Markdown file from a list of content."""
-    print(f"Đang tạo file Markdown: {filename}...")
+    log_item(logging.DEBUG, "export_start", f"Đang tạo file Markdown: {filename}...", file=filename, format="MD")
     md_content = f"# {title}\n\n"
     for item in content_list:
         if item['type'] == 'text':
@@ -338,15 +703,17 @@ def tao_file_md(content_list, filename, title="Chương truyện"):
             md_content += f'![Hình minh họa]({item["data"]})\n\n'
     
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(md_content)
-        print(f"Tạo file Markdown thành công: {filename}")
+        ghi_ket_qua(filename, md_content.encode('utf-8'))
+        log_item(logging.INFO, "export_done", f"Tạo file Markdown thành công: {filename}", file=filename, format="MD")
     except Exception as e:
-        print(f"!!! LỖI: Không thể tạo file MD '{filename}'. Lý do: {e}")
+        failure_ledger.record(filename, 'export', e, format="MD")
+        log_item(logging.ERROR, "export_failed", f"!!! LỖI: Không thể tạo file MD '{filename}'. Lý do: {e}",
+                 file=filename, format="MD", error=type(e).__name__)
 
+@traced("export")
 def tao_file_txt(content_list, filename, title="Chương truyện"):
     """Creates a plain text file from a list of content."""
-    print(f"Đang tạo file Text: {filename}...")
+    log_item(logging.DEBUG, "export_start", f"Đang tạo file Text: {filename}...", file=filename, format="TXT")
     txt_content = f"{title}\n\n"
     for item in content_list:
         if item['type'] == 'text':
@@ -355,14 +722,47 @@ def tao_file_txt(content_list, filename, title="Chương truyện"):
             txt_content += f'[Hình minh họa: {item["data"]}]\n\n'
     
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(txt_content)
-        print(f"Tạo file Text thành công: {filename}")
+        ghi_ket_qua(filename, txt_content.encode('utf-8'))
+        log_item(logging.INFO, "export_done", f"Tạo file Text thành công: {filename}", file=filename, format="TXT")
     except Exception as e:
-        print(f"!!! LỖI: Không thể tạo file TXT '{filename}'. Lý do: {e}")
+        failure_ledger.record(filename, 'export', e, format="TXT")
+        log_item(logging.ERROR, "export_failed", f"!!! LỖI: Không thể tạo file TXT '{filename}'. Lý do: {e}",
+                 file=filename, format="TXT", error=type(e).__name__)
 
 # --- LOGIC CHÍNH ---
 
+BASE_URL = "https://valvrareteam.net"
+
+VIETNAMESE_MAP = {
+    'à':'a', 'á':'a', 'ả':'a', 'ã':'a', 'ạ':'a', 'ă':'a', 'ằ':'a', 'ắ':'a', 'ẳ':'a', 'ẵ':'a', 'ặ':'a',
+    'â':'a', 'ầ':'a', 'ấ':'a', 'ẩ':'a', 'ẫ':'a', 'ậ':'a', 'đ':'d', 'è':'e', 'é':'e', 'ẻ':'e', 'ẽ':'e',
+    'ẹ':'e', 'ê':'e', 'ề':'e', 'ế':'e', 'ể':'e', 'ễ':'e', 'ệ':'e', 'ì':'i', 'í':'i', 'ỉ':'i', 'ĩ':'i',
+    'ị':'i', 'ò':'o', 'ó':'o', 'ỏ':'o', 'õ':'o', 'ọ':'o', 'ô':'o', 'ồ':'o', 'ố':'o', 'ổ':'o', 'ỗ':'o',
+    'ộ':'o', 'ơ':'o', 'ờ':'o', 'ớ':'o', 'ở':'o', 'ỡ':'o', 'ợ':'o', 'ù':'u', 'ú':'u', 'ủ':'u', 'ũ':'u',
+    'ụ':'u', 'ư':'u', 'ừ':'u', 'ứ':'u', 'ử':'u', 'ữ':'u', 'ự':'u', 'ỳ':'y', 'ý':'y', 'ỷ':'y', 'ỹ':'y', 'ỵ':'y'
+}
+
+def tim_trang_chinh(ten_truyen_raw, http_cache=None):
+    """
+    Looks the story up in the site's sitemap and returns the URL of its main page,
+    or None if no story matches the given name.
+    """
+    from bs4 import BeautifulSoup
+
+    sitemap_url = f"{BASE_URL}/sitemap.xml"
+    sitemap, _ = tai_url(sitemap_url, http_cache, resource_type='document')
+    soup = BeautifulSoup(sitemap, "lxml-xml")
+
+    ten_truyen_normalized = ten_truyen_raw.lower().replace(" ", "-")
+    for key, value in VIETNAMESE_MAP.items():
+        ten_truyen_normalized = ten_truyen_normalized.replace(key, value)
+
+    for loc in soup.find_all("loc"):
+        url = loc.text
+        if ten_truyen_normalized in url and "/chuong" not in url:
+            return url
+    return None
+
 def create_folders_from_tree(tree_file, base_folder):
     """Creates directory structure based on a tree map file."""
     try:
@@ -374,7 +774,7 @@ def create_folders_from_tree(tree_file, base_folder):
                 folder_path = os.path.join(base_folder, folder_name)
                 os.makedirs(folder_path, exist_ok=True)
     except FileNotFoundError:
-        print(f"Lưu ý: file tree_map.txt không tồn tại, sẽ tạo thư mục gốc.")
+        logger.warning("Lưu ý: file tree_map.txt không tồn tại, sẽ tạo thư mục gốc.")
         os.makedirs(base_folder, exist_ok=True)
 
 import argparse
@@ -383,134 +783,29 @@ import sys
 # (Các import khác giữ nguyên)
 # ...
 
-async def main():
-    parser = argparse.ArgumentParser(
-        description="Tải truyện từ Valvrare Team dưới dạng PDF, EPUB, và các định dạng khác.",
-        formatter_class=argparse.RawTextHelpFormatter
-    )
-    # Nếu có đối số dòng lệnh, dùng chế độ CLI, ngược lại, dùng chế độ tương tác
-    is_cli_mode = len(sys.argv) > 1
-
-    # --- Định nghĩa các đối số cho CLI ---
-    parser.add_argument(
-        'ten_truyen', 
-        nargs='?' if not is_cli_mode else None, 
-        help="Tên truyện cần tải (bắt buộc ở chế độ CLI)."
-    )
-    parser.add_argument(
-        '-o', '--output', 
-        dest='output_folder', 
-        help="Thư mục đầu ra để lưu file. Mặc định là tên truyện."
-    )
-    parser.add_argument(
-        '-f', '--format', 
-        nargs='+', 
-        default=['EPUB'], 
-        choices=['PDF', 'EPUB', 'HTML', 'MD', 'TXT'],
-        help="Định dạng file đầu ra. Có thể chọn nhiều. Mặc định: EPUB."
-    )
-    parser.add_argument(
-        '-g', '--gop', 
-        default='rieng', 
-        choices=['rieng', 'volume', 'tatca'],
-        help="Cách gộp file:\n"
-             "rieng: Mỗi chương một file (mặc định).\n"
-             "volume: Gộp các chương theo từng tập.\n"
-             "tatca: Gộp tất cả thành một file duy nhất."
-    )
-    parser.add_argument(
-        '--khong-minh-hoa', 
-        action='store_true',
-        help="Bỏ qua các chương/tập minh họa."
-    )
-    parser.add_argument(
-        '--font', 
-        default='DejaVuSans', 
-        choices=['NotoSerif', 'DejaVuSans'],
-        help="Font chữ cho file PDF. Mặc định: DejaVuSans."
-    )
-    parser.add_argument(
-        '-t', '--tasks', 
-        type=int, 
-        default=5,
-        help="Số lượng tác vụ tải song song. Mặc định: 5."
-    )
-    
-    selection_group = parser.add_mutually_exclusive_group()
-    selection_group.add_argument(
-        '--all', 
-        action='store_true',
-        help="Tải tất cả các chương (mặc định)."
-    )
-    selection_group.add_argument(
-        '--volumes', 
-        nargs='+', 
-        type=int,
-        help="Tải các tập cụ thể theo số thứ tự (ví dụ: --volumes 1 3 5)."
-    )
-    selection_group.add_argument(
-        '--chapters', 
-        nargs='+', 
-        type=int,
-        help="Tải các chương cụ thể theo số thứ tự tuyệt đối (ví dụ: --chapters 1 10 15)."
-    )
-
-    args = parser.parse_args()
-
-    # --- Logic chính ---
-    if is_cli_mode:
-        ten_truyen_raw = args.ten_truyen
-        if not ten_truyen_raw:
-            parser.error("Tên truyện là bắt buộc ở chế độ CLI.")
-    else:
-        ten_truyen_raw = input("Nhập tên truyện bạn muốn tải: ")
-
-    sitemap_url = "https://valvrareteam.net/sitemap.xml"
-    response = requests.get(sitemap_url)
-    soup = BeautifulSoup(response.content, "lxml-xml")
-    
-    ten_truyen_normalized = ten_truyen_raw.lower().replace(" ", "-")
-    output_folder = args.output_folder if is_cli_mode and args.output_folder else sanitize_filename(ten_truyen_raw.strip())
-    os.makedirs(output_folder, exist_ok=True)
-    
-    # ... (phần xử lý vietnamese_map giữ nguyên)
-    vietnamese_map = {
-        'à':'a', 'á':'a', 'ả':'a', 'ã':'a', 'ạ':'a', 'ă':'a', 'ằ':'a', 'ắ':'a', 'ẳ':'a', 'ẵ':'a', 'ặ':'a',
-        'â':'a', 'ầ':'a', 'ấ':'a', 'ẩ':'a', 'ẫ':'a', 'ậ':'a', 'đ':'d', 'è':'e', 'é':'e', 'ẻ':'e', 'ẽ':'e',
-        'ẹ':'e', 'ê':'e', 'ề':'e', 'ế':'e', 'ể':'e', 'ễ':'e', 'ệ':'e', 'ì':'i', 'í':'i', 'ỉ':'i', 'ĩ':'i',
-        'ị':'i', 'ò':'o', 'ó':'o', 'ỏ':'o', 'õ':'o', 'ọ':'o', 'ô':'o', 'ồ':'o', 'ố':'o', 'ổ':'o', 'ỗ':'o',
-        'ộ':'o', 'ơ':'o', 'ờ':'o', 'ớ':'o', 'ở':'o', 'ỡ':'o', 'ợ':'o', 'ù':'u', 'ú':'u', 'ủ':'u', 'ũ':'u',
-        'ụ':'u', 'ư':'u', 'ừ':'u', 'ứ':'u', 'ử':'u', 'ữ':'u', 'ự':'u', 'ỳ':'y', 'ý':'y', 'ỷ':'y', 'ỹ':'y', 'ỵ':'y'
-    }
-    for key, value in vietnamese_map.items():
-        ten_truyen_normalized = ten_truyen_normalized.replace(key, value)
-    # ...
-    trang_chinh = None
-    #... (phần tìm trang_chinh giữ nguyên)
-    for loc in soup.find_all("loc"):
-        url = loc.text
-        if ten_truyen_normalized in url and "/chuong" not in url:
-            trang_chinh = url
-            break
-    
+async def chon_chuong_can_tai(args, is_cli_mode, ten_truyen_raw, output_folder, http_cache, block_profile):
+    """
+    Looks the story up and resolves the user's choices (CLI arguments or interactive
+    menus): chapters, merge mode, formats, font and concurrency. Returns them as the
+    run settings dict stored in the failure ledger, or None when there is nothing to do.
+    """
+    trang_chinh = tim_trang_chinh(ten_truyen_raw, http_cache)
     if not trang_chinh:
-        print(f"Không tìm thấy truyện '{ten_truyen_raw}'. Vui lòng kiểm tra lại tên truyện.")
+        logger.error(f"Không tìm thấy truyện '{ten_truyen_raw}'. Vui lòng kiểm tra lại tên truyện.")
         return
 
     # ... (phần lay_thong_tin_truyen và get_chapter_tree_list giữ nguyên)
+    from playwright.async_api import async_playwright
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=True)
-        story_info = await lay_thong_tin_truyen(browser, trang_chinh.split("https://valvrareteam.net/")[-1])
+        context = await tao_context(browser, http_cache, block_profile)
+        story_info = await lay_thong_tin_truyen(context, trang_chinh.split(f"{BASE_URL}/")[-1], cover_dir=output_folder, http_cache=http_cache)
         await browser.close()
-    print("Đang lấy danh sách chương từ trang chính của truyện...")
-    await get_chapter_tree_list(trang_chinh, output_file="chapter_list.json")
-    await asyncio.sleep(1)
-    
-    try:
-        with open("chapter_list.json", "r", encoding="utf-8") as f:
-            chapter_data = json.load(f)
-    except Exception as e:
-        print(f"Đã xảy ra lỗi khi đọc file chapter_list.json: {e}")
+    logger.info("Đang lấy danh sách chương từ trang chính của truyện...")
+    # Danh sách chương được giữ trong bộ nhớ, không ghi ra file tạm trong thư mục hiện tại.
+    chapter_data = await get_chapter_tree_list(trang_chinh, output_file=None, http_cache=http_cache)
+    if not chapter_data:
+        logger.error("Không lấy được danh sách chương của truyện.")
         return
 
     # --- Xử lý lựa chọn của người dùng (CLI hoặc tương tác) ---
@@ -522,13 +817,13 @@ async def main():
         minh_hoa_choice = input("Bạn có muốn bỏ qua các chương minh họa không? (Y/n): ").strip().lower()
 
     if not minh_hoa_choice or minh_hoa_choice in ["y", "yes"]:
-        print("Bạn đã chọn bỏ qua các chương minh họa.")
+        logger.info("Bạn đã chọn bỏ qua các chương minh họa.")
         for volume_data in chapter_data:
             volume_data['chapters'] = [ch for ch in volume_data['chapters'] if 'minh-hoa' not in ch]
         chapter_data = [vol for vol in chapter_data if vol['chapters']]
 
     if not chapter_data:
-        print("Không có chương nào để tải sau khi đã lọc.")
+        logger.warning("Không có chương nào để tải sau khi đã lọc.")
         return
 
     # Chọn chương/tập để tải
@@ -540,7 +835,7 @@ async def main():
                 if 0 <= index < len(chapter_data):
                     selected_chapters_relative.extend(chapter_data[index]['chapters'])
                 else:
-                    print(f"[Cảnh báo] Bỏ qua chỉ số tập không hợp lệ: {index + 1}")
+                    logger.warning(f"[Cảnh báo] Bỏ qua chỉ số tập không hợp lệ: {index + 1}")
         elif args.chapters:
             all_chapters_flat = [chap_url for vol in chapter_data for chap_url in vol['chapters']]
             selected_indices = [int(i) - 1 for i in args.chapters]
@@ -548,11 +843,12 @@ async def main():
                 if 0 <= index < len(all_chapters_flat):
                     selected_chapters_relative.append(all_chapters_flat[index])
                 else:
-                    print(f"[Cảnh báo] Bỏ qua chỉ số chương không hợp lệ: {index + 1}")
+                    logger.warning(f"[Cảnh báo] Bỏ qua chỉ số chương không hợp lệ: {index + 1}")
         else: # Mặc định là tải tất cả
             selected_chapters_relative.extend(chap for vol in chapter_data for chap in vol['chapters'])
     else:
         # Menu chọn chương/tập (chế độ tương tác)
+        from simple_term_menu import TerminalMenu
         main_menu_items = ["Tải xuống tất cả", "Chọn tập để tải", "Chọn chương để tải"]
         main_menu = TerminalMenu(main_menu_items, title=" Tùy chọn tải xuống ", menu_cursor_style=("fg_cyan", "bold"), menu_highlight_style=("bg_cyan", "fg_black"))
         main_menu_selection_index = main_menu.show()
@@ -577,10 +873,10 @@ async def main():
                     selected_chapters_relative.append(all_chapters_for_menu[index][1])
 
     if not selected_chapters_relative:
-        print("Không có chương nào được chọn. Đang thoát.")
+        logger.warning("Không có chương nào được chọn. Đang thoát.")
         return
         
-    base_url = "https://valvrareteam.net"
+    base_url = BASE_URL
     chapter_urls = [base_url + rel_url for rel_url in selected_chapters_relative]
     
     # Chọn cách gộp và định dạng file
@@ -591,6 +887,7 @@ async def main():
         font_name = args.font
         CONCURRENT_TASKS = args.tasks
     else:
+        from simple_term_menu import TerminalMenu
         gop_menu_items = ["Xuất riêng từng chương (mặc định)", "Gộp các chương theo từng Volume", "Gộp tất cả chương đã chọn thành 1 file"]
         gop_menu = TerminalMenu(gop_menu_items, title=" Chọn cách thức xuất file ", menu_cursor_style=("fg_green", "bold"), menu_highlight_style=("bg_green", "fg_black"))
         gop_choice_index = gop_menu.show()
@@ -599,7 +896,7 @@ async def main():
         format_menu = TerminalMenu(format_items, title=" Chọn định dạng file (Space để chọn, Enter để xác nhận) ", multi_select=True, show_multi_select_hint=True, multi_select_cursor_style=("fg_yellow", "bold"))
         selected_format_indices = format_menu.show()
         if not selected_format_indices:
-            print("Không có định dạng nào được chọn. Đang thoát.")
+            logger.warning("Không có định dạng nào được chọn. Đang thoát.")
             return
         formats_to_export = [format_items[i] for i in selected_format_indices]
         
@@ -612,38 +909,406 @@ async def main():
         CONCURRENT_TASKS_str = input("Nhập số lượng tác vụ song song tối đa (mặc định là 5): ")
         CONCURRENT_TASKS = int(CONCURRENT_TASKS_str) if CONCURRENT_TASKS_str.isdigit() and int(CONCURRENT_TASKS_str) > 0 else 5
 
+    # Cập nhật EPUB theo tập: bỏ qua các chương đã có trong file EPUB của tập.
+    cap_nhat_epub = args.update_epub and gop_choice_index == 1 and "EPUB" in formats_to_export and not args.archive
+    if cap_nhat_epub and formats_to_export == ["EPUB"]:
+        url_to_volume = {base_url + ch: vol['volume'] for vol in chapter_data for ch in vol['chapters']}
+        titles_by_volume = {}
+        for vol in chapter_data:
+            vol_name = sanitize_filename(vol['volume'])
+            epub_path = os.path.join(output_folder, vol_name, f"{vol_name}.epub")
+            info = _doc_epub(epub_path) if os.path.exists(epub_path) else None
+            if info is not None:
+                titles_by_volume[vol['volume']] = set(info.chapter_titles)
+        so_chuong_truoc = len(chapter_urls)
+        chapter_urls = [url for url in chapter_urls
+                        if url.split("/")[-1] not in titles_by_volume.get(url_to_volume.get(url), ())]
+        logger.info(f"Bỏ qua {so_chuong_truoc - len(chapter_urls)} chương đã có trong các file EPUB hiện có.")
+        if not chapter_urls:
+            logger.info("Không có chương mới nào. Đang thoát.")
+            return
+
+    return {
+        'story': ten_truyen_raw,
+        'trang_chinh': trang_chinh,
+        'story_info': story_info,
+        'chapter_data': chapter_data,
+        'chapter_urls': chapter_urls,
+        'formats': formats_to_export,
+        'gop': gop_choice_index,
+        'font': font_name,
+        'tasks': CONCURRENT_TASKS,
+        'update_epub': cap_nhat_epub,
+        'archive': args.archive,
+        'archive_scope': args.archive_scope,
+        'pdf_workers': args.pdf_workers,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Tải truyện từ Valvrare Team dưới dạng PDF, EPUB, và các định dạng khác.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    # Nếu có đối số dòng lệnh, dùng chế độ CLI, ngược lại, dùng chế độ tương tác
+    is_cli_mode = len(sys.argv) > 1
+
+    # --- Định nghĩa các đối số cho CLI ---
+    parser.add_argument(
+        'ten_truyen', 
+        nargs='?' if not is_cli_mode else None, 
+        help="Tên truyện cần tải (bắt buộc ở chế độ CLI)."
+    )
+    parser.add_argument(
+        '-o', '--output', 
+        dest='output_folder', 
+        help="Thư mục đầu ra để lưu file. Mặc định là tên truyện."
+    )
+    parser.add_argument(
+        '-f', '--format', 
+        nargs='+', 
+        default=['EPUB'], 
+        choices=['PDF', 'EPUB', 'HTML', 'MD', 'TXT'],
+        help="Định dạng file đầu ra. Có thể chọn nhiều. Mặc định: EPUB."
+    )
+    parser.add_argument(
+        '-g', '--gop', 
+        default='rieng', 
+        choices=['rieng', 'volume', 'tatca'],
+        help="Cách gộp file:\n"
+             "rieng: Mỗi chương một file (mặc định).\n"
+             "volume: Gộp các chương theo từng tập.\n"
+             "tatca: Gộp tất cả thành một file duy nhất."
+    )
+    parser.add_argument(
+        '--khong-minh-hoa', 
+        action='store_true',
+        help="Bỏ qua các chương/tập minh họa."
+    )
+    parser.add_argument(
+        '--font', 
+        default='DejaVuSans', 
+        choices=['NotoSerif', 'DejaVuSans'],
+        help="Font chữ cho file PDF. Mặc định: DejaVuSans."
+    )
+    parser.add_argument(
+        '-t', '--tasks', 
+        type=int, 
+        default=5,
+        help="Số lượng tác vụ tải song song. Mặc định: 5."
+    )
+    parser.add_argument(
+        '--hedge',
+        type=float,
+        default=95,
+        help="Khi một chương chạy lâu hơn phân vị này (%%) của thời gian tải các chương trước,\n"
+             "mở thêm một lần tải dự phòng trên trang khác và giữ kết quả về trước. 0 = tắt. Mặc định: 95."
+    )
+    parser.add_argument(
+        '--image-tasks',
+        type=int,
+        default=8,
+        help="Số ảnh được tải trước song song trong lúc scraping (cho EPUB/PDF). 0 = tắt. Mặc định: 8."
+    )
+    parser.add_argument(
+        '--update-epub',
+        action='store_true',
+        help="Dùng với --gop volume: nếu file EPUB của tập đã tồn tại, chỉ thêm các chương mới vào\n"
+             "thay vì tạo lại cả tập (chỉ xuất EPUB thì các chương đã có sẽ không bị tải lại)."
+    )
+    parser.add_argument(
+        '--pdf-workers',
+        type=int,
+        default=1,
+        help="Số tiến trình dựng song song các phần PDF (mỗi tập một phần) khi gộp tất cả. Mặc định: 1."
+    )
+    parser.add_argument(
+        '--archive',
+        choices=['zip', 'tar'],
+        help="Ghi tất cả file đầu ra vào một file nén (zip/tar) thay vì tạo từng file lẻ,\n"
+             "giữ nguyên cấu trúc thư mục tập bên trong."
+    )
+    parser.add_argument(
+        '--archive-scope',
+        default='story',
+        choices=['story', 'volume'],
+        help="Dùng với --archive:\n"
+             "story: một file nén cho cả truyện (mặc định).\n"
+             "volume: mỗi tập một file nén."
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        help="Ghi các span (điều hướng, chờ selector, trích xuất, thử lại, tải ảnh, xuất file)\n"
+             "ra file JSON định dạng Chrome trace-event (mở bằng Perfetto)."
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help="Đo CPU của giai đoạn tạo file (pyinstrument nếu có, nếu không thì cProfile)."
+    )
+    log_group = parser.add_mutually_exclusive_group()
+    log_group.add_argument(
+        '-q', '--quiet',
+        action='store_true',
+        help="Chỉ hiện cảnh báo và lỗi trên màn hình (các sự kiện vẫn được ghi vào file log)."
+    )
+    log_group.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help="Hiện cả sự kiện của từng chương/ảnh/file trên màn hình."
+    )
+    parser.add_argument(
+        '--log-file',
+        metavar='FILE',
+        help="File log JSON-lines nhận mọi sự kiện (mỗi chương, ảnh, file xuất).\n"
+             "Mặc định: scraper_log.jsonl trong thư mục đầu ra. Dùng '' để tắt."
+    )
+    
+    parser.add_argument(
+        '--retry-failed',
+        action='store_true',
+        help="Chỉ tải lại các chương và tạo lại các file bị lỗi ở lần chạy trước (theo danh_sach_loi.json\n"
+             "trong thư mục đầu ra), dùng lại nội dung các chương đã tải được và cài đặt của lần chạy đó."
+    )
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help="Lưu JS/CSS/font/ảnh của trang vào bộ nhớ đệm cục bộ để các lần chạy sau không tải lại."
+    )
+    parser.add_argument(
+        '--replay',
+        action='store_true',
+        help="Ghi lại toàn bộ phản hồi của trang chương (kiểu HAR) và phát lại ở lần chạy sau (bao gồm --cache)."
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help="Chỉ dùng dữ liệu đã ghi trong bộ nhớ đệm (trang, sitemap, ảnh bìa, ảnh minh họa),\n"
+             "không truy cập mạng (bao gồm --replay)."
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default='.http_cache',
+        help="Thư mục chứa bộ nhớ đệm HTTP. Mặc định: .http_cache."
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=24,
+        help="Thời gian (giờ) một phản hồi chương đã ghi còn được phát lại. 0 = không hết hạn. Mặc định: 24."
+    )
+    parser.add_argument(
+        '--block',
+        default='scrape',
+        choices=list(BLOCK_PROFILES),
+        help="Profile chặn tài nguyên khi scraping:\n"
+             "scrape: chặn ảnh, font, media và tracker/quảng cáo (mặc định).\n"
+             "trackers: chỉ chặn tracker/quảng cáo.\n"
+             "none: không chặn gì."
+    )
+    parser.add_argument(
+        '--block-type',
+        nargs='+',
+        default=[],
+        choices=['image', 'media', 'font', 'stylesheet', 'script', 'xhr', 'fetch', 'websocket', 'other'],
+        help="Chặn thêm các loại tài nguyên này."
+    )
+    parser.add_argument(
+        '--block-url',
+        nargs='+',
+        default=[],
+        help="Chặn thêm các URL khớp mẫu (chuỗi con hoặc glob có *)."
+    )
+    parser.add_argument(
+        '--allow-url',
+        nargs='+',
+        default=[],
+        help="Luôn cho phép các URL khớp mẫu, kể cả khi bị profile chặn."
+    )
+    
+    selection_group = parser.add_mutually_exclusive_group()
+    selection_group.add_argument(
+        '--all', 
+        action='store_true',
+        help="Tải tất cả các chương (mặc định)."
+    )
+    selection_group.add_argument(
+        '--volumes', 
+        nargs='+', 
+        type=int,
+        help="Tải các tập cụ thể theo số thứ tự (ví dụ: --volumes 1 3 5)."
+    )
+    selection_group.add_argument(
+        '--chapters', 
+        nargs='+', 
+        type=int,
+        help="Tải các chương cụ thể theo số thứ tự tuyệt đối (ví dụ: --chapters 1 10 15)."
+    )
+
+    args = parser.parse_args()
+    if args.trace:
+        tracer.enable(args.trace)
+
+    # --- Logic chính ---
+    if is_cli_mode:
+        ten_truyen_raw = args.ten_truyen
+        if not ten_truyen_raw:
+            parser.error("Tên truyện là bắt buộc ở chế độ CLI.")
+    else:
+        ten_truyen_raw = input("Nhập tên truyện bạn muốn tải: ")
+
+    output_folder = args.output_folder if is_cli_mode and args.output_folder else sanitize_filename(ten_truyen_raw.strip())
+    os.makedirs(output_folder, exist_ok=True)
+    log_file = args.log_file if args.log_file is not None else os.path.join(output_folder, "scraper_log.jsonl")
+    global nhat_ky
+    nhat_ky = RunLog(log_file or None, quiet=args.quiet, verbose=args.verbose).start()
+
+    http_cache = None
+    if args.cache or args.replay or args.offline:
+        http_cache = HttpCache(
+            args.cache_dir,
+            replay=args.replay or args.offline,
+            ttl=args.cache_ttl * 3600 if args.cache_ttl > 0 else None,
+            offline=args.offline
+        )
+    block_profile = BlockProfile.from_name(args.block, args.block_type, args.block_url, args.allow_url)
+    global shared_http_cache
+    shared_http_cache = http_cache
+
+    global failure_ledger
+    ledger_path = os.path.join(output_folder, "danh_sach_loi.json")
+    if args.retry_failed:
+        if not os.path.exists(ledger_path):
+            logger.info(f"Không có danh sách lỗi '{ledger_path}', không có gì để thử lại.")
+            return
+        failure_ledger = FailureLedger.load(ledger_path)
+        run = failure_ledger.run
+        ten_truyen_raw = run['story']
+        run['tasks'] = args.tasks
+        # Tạo lại file với đúng cách xuất của lần chạy trước.
+        args.archive = run.get('archive')
+        args.archive_scope = run.get('archive_scope', args.archive_scope)
+        args.pdf_workers = run.get('pdf_workers', args.pdf_workers)
+        so_file_loi = sum(entry['target'] != TAT_CA_FILE for entry in failure_ledger.entries('export'))
+        logger.info(f"Thử lại {len(failure_ledger.entries('scrape'))} chương và {so_file_loi} file bị lỗi ở lần chạy trước...")
+    else:
+        run = await chon_chuong_can_tai(args, is_cli_mode, ten_truyen_raw, output_folder, http_cache, block_profile)
+        if run is None:
+            return
+        failure_ledger = FailureLedger(ledger_path, run)
+    # Lần trước dừng trước khi tạo xong các file: phải tạo lại tất cả.
+    xuat_lai_tat_ca = failure_ledger.has(TAT_CA_FILE, 'export')
+    failure_ledger.record(TAT_CA_FILE, 'export', "Interrupted", "lần chạy dừng trước khi tạo xong các file")
+    # Ghi ngay để sổ lỗi cũ của lần chạy khác không còn bị tin nhầm nếu lần này dừng sớm.
+    failure_ledger.save()
+    # Nội dung các chương đã tải (ở lần trước nếu đang thử lại), dùng lại khi xuất các file gộp.
+    scraped_content = failure_ledger.content
+
+    base_url = BASE_URL
+    trang_chinh = run['trang_chinh']
+    story_info = run['story_info']
+    chapter_data = run['chapter_data']
+    chapter_urls = run['chapter_urls']
+    formats_to_export = run['formats']
+    gop_choice_index = run['gop']
+    font_name = run['font']
+    CONCURRENT_TASKS = run['tasks']
+    cap_nhat_epub = run['update_epub']
+    # Chương cần tải: cả lựa chọn, hoặc chỉ các chương lỗi khi --retry-failed.
+    urls_can_tai = [entry['target'] for entry in failure_ledger.entries('scrape')] if args.retry_failed else chapter_urls
+
     semaphore = asyncio.Semaphore(CONCURRENT_TASKS)
+
+    # Tải trước ảnh song song với việc scraping, chỉ khi có định dạng cần nhúng ảnh.
+    global image_prefetcher
+    if args.image_tasks > 0 and any(fmt in ("PDF", "EPUB") for fmt in formats_to_export):
+        image_prefetcher = ImagePrefetcher(max_concurrency=args.image_tasks, http_cache=http_cache)
     # ... (phần còn lại của logic tải và xử lý file giữ nguyên)
     
-    print(f"Chuẩn bị tải {len(chapter_urls)} chương với tối đa {CONCURRENT_TASKS} tác vụ song song...")
+    logger.info(f"Chuẩn bị tải {len(urls_can_tai)} chương với tối đa {CONCURRENT_TASKS} tác vụ song song...")
 
-    # Tạo cấu trúc thư mục trước
-    tree_path = os.path.join(output_folder, "tree_map.txt")
-    await get_chapter_tree_folder(url=trang_chinh, output_file=tree_path)
-    create_folders_from_tree(tree_path, output_folder)
+    # Tạo cấu trúc thư mục trước (khi thử lại, các thư mục đã có từ lần chạy trước)
+    if not args.archive and not args.retry_failed:
+        tree_path = os.path.join(output_folder, "tree_map.txt")
+        await get_chapter_tree_folder(url=trang_chinh, output_file=tree_path, http_cache=http_cache)
+        create_folders_from_tree(tree_path, output_folder)
     
-    # Dictionary để lưu content đã scrape
-    scraped_content = {}
-    
-    async def process_url(browser, url):
+    slots = SlotPool(CONCURRENT_TASKS)
+    scheduler = HedgedScheduler(
+        functools.partial(lay_chuong_voi_hinh_anh, failure_ledger=failure_ledger),
+        percentile=args.hedge / 100 if args.hedge > 0 else None,
+        max_hedges=max(1, CONCURRENT_TASKS // 2)
+    )
+    # Các chương lỗi ở lượt đầu, được thử lại một lần cuối với context mới.
+    retry_queue = []
+
+    async def process_url(browser, url, task_id, is_retry=False):
+        current_task.set(task_id)
+        tracer.async_begin("queue_wait", "scheduler", task_id, url=url)
         async with semaphore:
-            content = await lay_chuong_voi_hinh_anh(browser, url)
+            tracer.async_end("queue_wait", "scheduler", task_id)
+            slot = slots.acquire()
+            try:
+                with tracer.span("chapter", "scrape", url=url, slot=slot, retry=is_retry):
+                    content = await scheduler.run(browser, url)
+            finally:
+                slots.release(slot)
             if content:
                 scraped_content[url] = content
+                failure_ledger.resolve(url, 'scrape')
+                if image_prefetcher is not None:
+                    image_prefetcher.submit(item['data'] for item in content if item['type'] == 'image')
+            elif not is_retry:
+                retry_queue.append((url, task_id))
             else:
-                skipped_urls.append(url)
-                print(f"Đã thêm {url} vào danh sách các chương bị bỏ qua.")
+                if not failure_ledger.has(url, 'scrape'):
+                    failure_ledger.record(url, 'scrape', "NoContent", "trang chương không có nội dung")
+                log_item(logging.WARNING, "chapter_skipped", f"Đã thêm {url} vào danh sách các chương bị bỏ qua.", url=url)
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        tasks = [process_url(browser, url) for url in chapter_urls]
-        with alive_bar(len(tasks), title=f"Đang tải nội dung", bar='filling', spinner='dots_waves') as bar:
-            for future in asyncio.as_completed(tasks):
-                await future
-                bar()
-        await browser.close()
+    from alive_progress import alive_bar
+    from playwright.async_api import async_playwright
+
+    bat_dau_tai = time.perf_counter()
+    if urls_can_tai:
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            context = await tao_context(browser, http_cache, block_profile)
+            tasks = [process_url(context, url, task_id) for task_id, url in enumerate(urls_can_tai, start=1)]
+            with alive_bar(len(tasks), title=f"Đang tải nội dung", bar='filling', spinner='dots_waves') as bar:
+                for future in asyncio.as_completed(tasks):
+                    await future
+                    bar()
+            if retry_queue:
+                logger.info(f"Đang thử lại {len(retry_queue)} chương bị lỗi với context trình duyệt mới...")
+                await context.close()
+                context = await tao_context(browser, http_cache, block_profile)
+                await asyncio.gather(*(process_url(context, url, task_id, is_retry=True) for url, task_id in retry_queue))
+            await browser.close()
+    thoi_gian_tai = time.perf_counter() - bat_dau_tai
+    so_chuong_da_tai = sum(url in scraped_content for url in urls_can_tai)
+    logger.info(f"Đã tải {so_chuong_da_tai}/{len(urls_can_tai)} chương trong {thoi_gian_tai:.1f} giây "
+                f"({so_chuong_da_tai / max(thoi_gian_tai, 1e-9):.2f} chương/giây, {nhat_ky.counts['scrape_retry']} lần thử lại).")
+    if scheduler.hedged:
+        logger.info(f"Đã tải dự phòng {scheduler.hedged} chương chậm ({scheduler.hedge_wins} lần bản dự phòng về trước).")
     
-    print("Đã tải xong nội dung. Bắt đầu tạo file...")
+    if http_cache is not None:
+        logger.info(f"Bộ nhớ đệm HTTP: {http_cache.hits} lần dùng lại, {http_cache.misses} lần tải mới.")
+    if block_profile.blocked:
+        logger.info(f"Đã chặn {block_profile.blocked} yêu cầu không cần thiết (profile '{args.block}').")
+    if image_prefetcher is not None:
+        logger.info("Đang chờ tải xong các ảnh minh họa...")
+        await image_prefetcher.drain()
+        logger.info(f"Đã tải trước {image_prefetcher.done} ảnh ({image_prefetcher.failed} ảnh lỗi sẽ được thử lại khi tạo file).")
+    luu_so_loi()
+    logger.info("Đã tải xong nội dung. Bắt đầu tạo file...")
+    bat_dau_xuat = time.perf_counter()
+    global output_archive
+    if args.archive:
+        output_archive = OutputArchive(output_folder, sanitize_filename(ten_truyen_raw), kind=args.archive, scope=args.archive_scope)
+    export_profiler = None
+    if args.profile:
+        export_profiler = ExportProfiler()
+        export_profiler.start()
     
     # --- Xử lý tạo file sau khi đã scrape ---
     
@@ -653,6 +1318,19 @@ async def main():
         for chap_url in vol_info['chapters']:
             url_to_volume_map[chap_url] = vol_info['volume']
 
+    # Khi --retry-failed, chỉ xuất lại file có chương vừa tải lại được hoặc file đã lỗi lần trước.
+    # Với --archive thì xuất lại tất cả, vì file nén mới sẽ thay thế file nén cũ.
+    chuong_moi = None
+    if args.retry_failed and not args.archive and not xuat_lai_tat_ca:
+        chuong_moi = {url for url in urls_can_tai if url in scraped_content}
+    file_loi = {entry['target'] for entry in failure_ledger.entries('export')}
+
+    def can_xuat(file_path, urls):
+        if chuong_moi is not None and file_path not in file_loi and chuong_moi.isdisjoint(urls):
+            return False
+        failure_ledger.resolve(file_path, 'export')
+        return True
+
     # 1. Xuất riêng từng chương
     if gop_choice_index == 0:
         for url in chapter_urls:
@@ -660,7 +1338,8 @@ async def main():
                 relative_url = url.replace(base_url, "")
                 volume_name = url_to_volume_map.get(relative_url, "Unknown Volume")
                 current_folder = os.path.join(output_folder, sanitize_filename(volume_name))
-                os.makedirs(current_folder, exist_ok=True)
+                if output_archive is None:
+                    os.makedirs(current_folder, exist_ok=True)
                 
                 ten_chuong = url.split("/")[-1]
                 content_list = scraped_content[url]
@@ -670,6 +1349,8 @@ async def main():
 
                 for fmt in formats_to_export:
                     file_path = os.path.join(current_folder, f"{ten_chuong}.{fmt.lower().split(' ')[0].replace('(.md)', '.md').replace('(.txt)', '.txt')}")
+                    if not can_xuat(file_path, [url]):
+                        continue
                     if fmt == "PDF":
                         tao_file_pdf(content_list, file_path, ten_chuong, font_name)
                     elif fmt == "EPUB":
@@ -685,12 +1366,15 @@ async def main():
     # 2. Gộp theo Volume
     elif gop_choice_index == 1:
         volume_contents = {}
+        volume_urls = {}
         for url in chapter_urls:
             if url in scraped_content:
                 relative_url = url.replace(base_url, "")
                 volume_name = url_to_volume_map.get(relative_url, "Unknown Volume")
                 if volume_name not in volume_contents:
                     volume_contents[volume_name] = []
+                    volume_urls[volume_name] = []
+                volume_urls[volume_name].append(url)
                 
                 ten_chuong = url.split("/")[-1]
                 volume_contents[volume_name].append({
@@ -706,7 +1390,8 @@ async def main():
             sanitized_vol_name = sanitize_filename(volume_name)
             # Volume folder is not strictly needed when merging, but let's keep it clean
             current_folder = os.path.join(output_folder, sanitized_vol_name)
-            os.makedirs(current_folder, exist_ok=True)
+            if output_archive is None:
+                os.makedirs(current_folder, exist_ok=True)
             
             # Use the full content of the volume for PDF and other simple formats
             full_volume_content = []
@@ -715,10 +1400,15 @@ async def main():
 
             for fmt in formats_to_export:
                 file_path = os.path.join(current_folder, f"{sanitized_vol_name}.{fmt.lower().split(' ')[0].replace('(.md)', '.md').replace('(.txt)', '.txt')}")
+                if not can_xuat(file_path, volume_urls[volume_name]):
+                    continue
                 if fmt == "PDF":
                     tao_file_pdf(full_volume_content, file_path, volume_name, font_name)
                 elif fmt == "EPUB":
-                    tao_file_epub(file_path, volume_name, author, chapters_list, description, cover_path)
+                    if cap_nhat_epub and os.path.exists(file_path) and _doc_epub(file_path) is not None:
+                        cap_nhat_file_epub(file_path, chapters_list)
+                    else:
+                        tao_file_epub(file_path, volume_name, author, chapters_list, description, cover_path)
                 elif fmt == "HTML":
                     tao_file_html(full_volume_content, file_path, volume_name)
                 elif fmt == "Markdown (.md)":
@@ -755,8 +1445,10 @@ async def main():
 
         for fmt in formats_to_export:
             file_path = os.path.join(output_folder, f"{sanitized_story_name}.{fmt.lower().split(' ')[0].replace('(.md)', '.md').replace('(.txt)', '.txt')}")
+            if not can_xuat(file_path, scraped_content):
+                continue
             if fmt == "PDF":
-                tao_file_pdf(full_content_list_simple, file_path, ten_truyen_raw, font_name)
+                tao_file_pdf_theo_tap(full_story_structure, file_path, ten_truyen_raw, font_name, args.pdf_workers)
             elif fmt == "EPUB":
                 tao_file_epub(file_path, ten_truyen_raw, author, full_story_structure, description, cover_path)
             elif fmt == "HTML":
@@ -766,14 +1458,29 @@ async def main():
             elif fmt == "Text (.txt)":
                 tao_file_txt(full_content_list_simple, file_path, ten_truyen_raw)
                 
-    print("\n--- HOÀN TẤT ---")
-    if skipped_urls:
-        log_file_path = os.path.join(output_folder, "cac_chuong_da_bo_qua.txt")
-        print(f"(!) Cảnh báo: {len(skipped_urls)} chương đã bị bỏ qua do lỗi.")
-        print(f"Đang ghi danh sách các chương bị lỗi vào file: {log_file_path}")
-        with open(log_file_path, "w", encoding="utf-8") as f:
-            for url in skipped_urls:
-                f.write(f"{url}\n")
+    thoi_gian_xuat = time.perf_counter() - bat_dau_xuat
+    logger.info(f"Đã tạo {nhat_ky.counts['export_done']} file trong {thoi_gian_xuat:.1f} giây "
+                f"({nhat_ky.counts['export_failed']} file lỗi, {nhat_ky.counts['image_failed']} ảnh lỗi).")
+    if output_archive is not None:
+        for archive_path in output_archive.close():
+            logger.info(f"Đã ghi file nén: {archive_path}")
+        output_archive = None
+    failure_ledger.resolve(TAT_CA_FILE, 'export')
+    if export_profiler is not None:
+        export_profiler.stop()
+        profile_path = export_profiler.save(os.path.join(output_folder, "profile_tao_file"))
+        logger.info(f"Đã ghi profile CPU ({export_profiler.backend}) của giai đoạn tạo file: {profile_path}")
+
+    logger.info("\n--- HOÀN TẤT ---")
+    # Sổ lỗi rỗng thì file cũ (nếu có) bị xóa: không còn gì để thử lại.
+    luu_so_loi()
+    if failure_ledger:
+        logger.warning(f"(!) Cảnh báo: {len(failure_ledger.entries('scrape'))} chương bị bỏ qua và "
+                       f"{len(failure_ledger.entries('export'))} file không tạo được do lỗi.")
+        logger.info(f"Danh sách lỗi đã được ghi vào: {ledger_path}")
+        logger.info("Chạy lại với --retry-failed để chỉ thử lại các mục này.")
+    elif args.retry_failed:
+        logger.info("Đã khôi phục tất cả các mục bị lỗi ở lần chạy trước.")
     
 
 if __name__ == "__main__":
@@ -782,6 +1489,15 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("\nChương trình bị dừng bởi người dùng.")
     finally:
-        if os.path.exists("chapter_list.json"):
-            os.remove("chapter_list.json")
-        print("Đã dọn dẹp file tạm. Hẹn gặp lại!")
+        # Ghi trace cả khi lần chạy lỗi hoặc dừng sớm: đó là lúc cần xem trace nhất.
+        if tracer.enabled and tracer.path:
+            tracer.write()
+            logger.info(f"Đã ghi trace vào {tracer.path} (mở bằng https://ui.perfetto.dev).")
+        # Lưu sổ lỗi cả khi lần chạy lỗi hoặc bị dừng, để --retry-failed tiếp tục từ đó.
+        luu_so_loi()
+        # Dọn thư mục ảnh tạm cả khi chương trình lỗi hoặc bị dừng giữa chừng.
+        if image_prefetcher is not None:
+            image_prefetcher.close()
+        if nhat_ky is not None:
+            nhat_ky.stop()
+        print("Hẹn gặp lại!")
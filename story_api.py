@@ -0,0 +1,135 @@
+import asyncio
+import shutil
+import tempfile
+
+from scraper import BASE_URL, lay_thong_tin_truyen, lay_chuong_voi_hinh_anh, tim_trang_chinh
+from tao_so_do_cay import get_chapter_tree_list
+from http_cache import tao_context
+
+
+class StorySession:
+    """
+    Embeddable async API for one story, without argparse, menus or files in the
+    current working directory. All state lives in memory or in a per-session
+    directory, so many sessions can run side by side in one process.
+
+        async with StorySession("ten truyen") as story:
+            info = await story.thong_tin()
+            async for chapter in story.chapters(volumes=[1]):
+                ...  # {'index', 'url', 'volume', 'title', 'content'}
+
+    - ten_truyen: story name (looked up in the sitemap) or the URL of its main page.
+    - tasks: maximum number of chapters scraped concurrently.
+    - work_dir: where per-session files (the cover) go. A temporary directory is
+      created and removed on exit when it is not given.
+    - http_cache / block_profile: optional HttpCache and BlockProfile for the browser context.
+    """
+
+    def __init__(self, ten_truyen, tasks=5, work_dir=None, http_cache=None, block_profile=None):
+        self.ten_truyen = ten_truyen
+        self.tasks = tasks
+        self._owns_work_dir = work_dir is None
+        self.work_dir = work_dir
+        self.http_cache = http_cache
+        self.block_profile = block_profile
+        self.trang_chinh = None
+        self.skipped_urls = []
+        self._info = None
+        self._index = None
+        self._playwright = None
+        self._browser = None
+        self._context = None
+
+    async def __aenter__(self):
+        if self.ten_truyen.startswith(('http://', 'https://')):
+            self.trang_chinh = self.ten_truyen
+        else:
+            loop = asyncio.get_running_loop()
+            self.trang_chinh = await loop.run_in_executor(None, tim_trang_chinh, self.ten_truyen, self.http_cache)
+        if not self.trang_chinh:
+            raise LookupError(f"Không tìm thấy truyện '{self.ten_truyen}'.")
+        if self.work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix="valvrare_")
+
+        from playwright.async_api import async_playwright
+        self._playwright = await async_playwright().start()
+        try:
+            self._browser = await self._playwright.chromium.launch(headless=True)
+            self._context = await tao_context(self._browser, self.http_cache, self.block_profile)
+        except BaseException:
+            # __aexit__ không được gọi khi __aenter__ lỗi: tự đóng những gì đã mở.
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+        if self._owns_work_dir and self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        return False
+
+    async def thong_tin(self):
+        """Returns the story info (title, author, description, cover_path inside work_dir)."""
+        if self._info is None:
+            self._info = await lay_thong_tin_truyen(
+                self._context, self.trang_chinh.split(f"{BASE_URL}/")[-1], cover_dir=self.work_dir,
+                http_cache=self.http_cache
+            )
+        return self._info
+
+    async def muc_luc(self):
+        """Returns the story index: [{'volume': str, 'chapters': [relative urls]}]."""
+        if self._index is None:
+            self._index = await get_chapter_tree_list(self.trang_chinh, output_file=None, http_cache=self.http_cache)
+        return self._index
+
+    async def chon_chuong(self, volumes=None, chapters=None, skip_illustrations=False):
+        """
+        Resolves a selection into [(volume title, chapter url)] in story order.
+        `volumes` and `chapters` are 1-based indices, like the CLI's --volumes/--chapters.
+        """
+        index = await self.muc_luc()
+        if skip_illustrations:
+            index = [{'volume': vol['volume'], 'chapters': [ch for ch in vol['chapters'] if 'minh-hoa' not in ch]}
+                     for vol in index]
+            index = [vol for vol in index if vol['chapters']]
+
+        flat = [(vol['volume'], BASE_URL + ch) for vol in index for ch in vol['chapters']]
+        if volumes:
+            return [(index[i - 1]['volume'], BASE_URL + ch) for i in volumes if 0 < i <= len(index)
+                    for ch in index[i - 1]['chapters']]
+        if chapters:
+            return [flat[i - 1] for i in chapters if 0 < i <= len(flat)]
+        return flat
+
+    async def chapters(self, volumes=None, chapters=None, skip_illustrations=False, ordered=True):
+        """
+        Async iterator over the selected chapters, scraped with at most `tasks` pages at
+        once. With `ordered=True` chapters are yielded in story order, otherwise as soon
+        as each one finishes. Chapters that fail are recorded in `skipped_urls`.
+        """
+        selection = await self.chon_chuong(volumes, chapters, skip_illustrations)
+        semaphore = asyncio.Semaphore(self.tasks)
+
+        async def scrape(index, volume, url):
+            async with semaphore:
+                content = await lay_chuong_voi_hinh_anh(self._context, url)
+            return {'index': index, 'url': url, 'volume': volume, 'title': url.split('/')[-1], 'content': content}
+
+        pending = [asyncio.ensure_future(scrape(i, volume, url)) for i, (volume, url) in enumerate(selection, start=1)]
+        try:
+            for future in (pending if ordered else asyncio.as_completed(pending)):
+                chapter = await future
+                if chapter['content']:
+                    yield chapter
+                else:
+                    self.skipped_urls.append(chapter['url'])
+        finally:
+            # Người dùng dừng vòng lặp sớm: hủy các chương chưa tải xong.
+            for future in pending:
+                future.cancel()
+            # Chờ các tác vụ bị hủy kết thúc hẳn trước khi phiên đóng trình duyệt.
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -1,9 +1,8 @@
 import asyncio
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
 import json                                                                                                                                                                                                         
+from http_cache import tao_context
 
-async def get_chapter_tree(url: str, output_file: str):
+async def get_chapter_tree(url: str, output_file: str, http_cache=None):
     print("Đang tạo sơ đồ cây...")
     """
     Sử dụng Playwright Async API để truy cập URL, sau đó dùng BeautifulSoup để
@@ -13,11 +12,16 @@ async def get_chapter_tree(url: str, output_file: str):
     Args:
         url (str): URL của trang truyện.
         output_file (str): Tên của file txt để lưu sơ đồ.
+        http_cache (HttpCache, optional): Bộ nhớ đệm HTTP gắn vào context của trình duyệt.
     """
+    from playwright.async_api import async_playwright
+    from bs4 import BeautifulSoup
+
     try:
         async with async_playwright() as p:
             browser = await p.chromium.launch()
-            page = await browser.new_page()
+            context = await tao_context(browser, http_cache)
+            page = await context.new_page()
             await page.goto(url, wait_until='networkidle')
             html_content = await page.content()
             await browser.close()
@@ -61,7 +65,7 @@ async def get_chapter_tree(url: str, output_file: str):
     except Exception as e:
         print(f"Đã xảy ra lỗi: {e}")
 
-async def get_chapter_tree_folder(url: str, output_file: str):
+async def get_chapter_tree_folder(url: str, output_file: str, http_cache=None):
     print("Đang tạo thư mục...")
     """
     Sử dụng Playwright Async API để truy cập URL, sau đó dùng BeautifulSoup để
@@ -71,11 +75,16 @@ async def get_chapter_tree_folder(url: str, output_file: str):
     Args:
         url (str): URL của trang truyện.
         output_file (str): Tên của file txt để lưu sơ đồ.
+        http_cache (HttpCache, optional): Bộ nhớ đệm HTTP gắn vào context của trình duyệt.
     """
+    from playwright.async_api import async_playwright
+    from bs4 import BeautifulSoup
+
     try:
         async with async_playwright() as p:
             browser = await p.chromium.launch()
-            page = await browser.new_page()
+            context = await tao_context(browser, http_cache)
+            page = await context.new_page()
             await page.goto(url, wait_until='networkidle')
             html_content = await page.content()
             await browser.close()
@@ -109,13 +118,17 @@ async def get_chapter_tree_folder(url: str, output_file: str):
     except Exception as e:
         print(f"Đã xảy ra lỗi: {e}")
 #creat list chapter
-async def get_chapter_tree_list(url: str, output_file: str = "chapter_list.json"):
+async def get_chapter_tree_list(url: str, output_file: str = "chapter_list.json", http_cache=None):
     print("Đang tạo sơ đồ cây...")
 
+    from playwright.async_api import async_playwright
+    from bs4 import BeautifulSoup
+
     try:
         async with async_playwright() as p:
             browser = await p.chromium.launch()
-            page = await browser.new_page()
+            context = await tao_context(browser, http_cache)
+            page = await context.new_page()
             await page.goto(url, wait_until='networkidle')
             html_content = await page.content()
             await browser.close()
@@ -154,11 +167,11 @@ async def get_chapter_tree_list(url: str, output_file: str = "chapter_list.json"
                 "chapters": chapters_list
             })
 
-        # Lưu ra file JSON
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-
-        print(f"Đã lưu sơ đồ cây vào {output_file}")
+        # Lưu ra file JSON (bỏ qua nếu output_file=None, chỉ trả về dữ liệu)
+        if output_file:
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            print(f"Đã lưu sơ đồ cây vào {output_file}")
         return data
 
     except Exception as e:
@@ -0,0 +1,42 @@
+import re
+import zipfile
+
+import pytest
+
+import epub_update
+import scraper
+from epub_update import EpubInfo
+
+
+def _chuong(n):
+    return {'title': f"Chương {n}", 'content': [{'type': 'text', 'data': f"Nội dung chương {n} & <thẻ>."}]}
+
+
+def _spine_hrefs(path):
+    info = EpubInfo(path)
+    with zipfile.ZipFile(path) as zf:
+        opf = zf.read(info.opf_path).decode('utf-8')
+    spine = re.search(r'<(?:\w+:)?spine\b.*?</(?:\w+:)?spine>', opf, re.S).group(0)
+    return [info.items[idref][0] for idref in re.findall(r'idref="([^"]+)"', spine)]
+
+
+@pytest.mark.parametrize('chep_tho', [True, False])
+def test_append_round_trip(tmp_path, monkeypatch, chep_tho):
+    if not chep_tho:
+        # Python không còn các thuộc tính nội bộ: mục được giải nén rồi ghi lại.
+        monkeypatch.setattr(epub_update, '_co_the_chep_tho', lambda zout: False)
+    path = str(tmp_path / "truyen.epub")
+    scraper.tao_file_epub(path, "Truyện", "Tác giả", [_chuong(1), _chuong(2)])
+    hrefs_truoc = _spine_hrefs(path)
+
+    added = scraper.cap_nhat_file_epub(path, [_chuong(2), _chuong(3), _chuong(4)])
+
+    assert added == 2
+    assert EpubInfo(path).chapter_titles == ["Chương 1", "Chương 2", "Chương 3", "Chương 4"]
+    hrefs = _spine_hrefs(path)
+    assert hrefs[:len(hrefs_truoc)] == hrefs_truoc
+    assert [h for h in hrefs if re.search(r'chap_\d+\.xhtml$', h)][-2:] == ['chap_3.xhtml', 'chap_4.xhtml']
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert "Nội dung chương 4 &amp; &lt;thẻ&gt;." in zf.read(EpubInfo(path)._entry('chap_4.xhtml')).decode('utf-8')
+        assert not scraper.failure_ledger.has(path, 'export')
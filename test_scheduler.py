@@ -0,0 +1,66 @@
+import asyncio
+
+from scheduler import HedgedScheduler
+
+
+class TrangGia:
+    """Stub scrape: the n-th call for a URL behaves as given; `finally` awaits like page.close()."""
+
+    def __init__(self, *behaviours, close_delay=0.2):
+        self.behaviours = behaviours
+        self.close_delay = close_delay
+        self.calls = {}
+        self.open_pages = 0
+
+    async def __call__(self, context, url):
+        call = self.calls.get(url, 0)
+        self.calls[url] = call + 1
+        delay, content = self.behaviours[min(call, len(self.behaviours) - 1)]
+        self.open_pages += 1
+        try:
+            await asyncio.sleep(delay)
+            return content
+        finally:
+            await asyncio.sleep(self.close_delay)
+            self.open_pages -= 1
+
+
+def _scheduler(scrape):
+    scheduler = HedgedScheduler(scrape, percentile=0.01, max_hedges=1, min_samples=1, min_delay=0.05)
+    scheduler.latencies.add(0.01)
+    return scheduler
+
+
+def test_hedge_lane_is_released_only_after_loser_unwinds():
+    # Lần thử chính thắng, bản dự phòng (kẻ thua) còn đang đóng trang khi chương thứ hai
+    # chạy chậm và muốn mở bản dự phòng: không được lỗi hết làn.
+    scrape = TrangGia((0.1, "chinh"), (10, "du phong"))
+    scheduler = _scheduler(scrape)
+
+    async def chay():
+        first = asyncio.ensure_future(scheduler.run(None, "a"))
+        # Lần thử chính của "a" xong lúc ~0.3s (0.1s tải + 0.2s đóng trang), kẻ thua đóng trang tới ~0.5s.
+        await asyncio.sleep(0.35)
+        second = asyncio.ensure_future(scheduler.run(None, "b"))
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        return results, scrape.open_pages
+
+    results, open_pages = asyncio.run(chay())
+    assert results == ["chinh", "chinh"]
+    assert open_pages == 0
+    assert scheduler.hedged >= 1
+    assert scheduler.hedge_wins == 0
+
+
+def test_hedge_wins_and_primary_is_closed_before_returning():
+    scrape = TrangGia((10, "chinh"), (0.01, "du phong"), close_delay=0.05)
+    scheduler = _scheduler(scrape)
+
+    async def chay():
+        content = await scheduler.run(None, "a")
+        return content, scrape.open_pages
+
+    content, open_pages = asyncio.run(chay())
+    assert content == "du phong"
+    assert open_pages == 0
+    assert scheduler.hedge_wins == 1
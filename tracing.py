@@ -0,0 +1,201 @@
+import contextvars
+import functools
+import json
+import os
+import time
+
+# Slot của semaphore (hoặc của bộ tải ảnh) mà tác vụ hiện tại đang giữ; dùng làm "tid" trong trace.
+current_slot = contextvars.ContextVar('current_slot', default=0)
+# Số thứ tự của chương/tác vụ hiện tại, được gắn vào args của mỗi span.
+current_task = contextvars.ContextVar('current_task', default=None)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **args):
+        """Adds extra arguments to the span before it is closed."""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.tid = current_slot.get()
+        task_id = current_task.get()
+        if task_id is not None:
+            self.args.setdefault('task', task_id)
+        self.start = self.tracer._now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = f"{exc_type.__name__}: {exc}"
+        self.tracer._add({
+            'name': self.name, 'cat': self.cat, 'ph': 'X',
+            'ts': self.start, 'dur': self.tracer._now() - self.start,
+            'pid': self.tracer.pid, 'tid': self.tid, 'args': self.args,
+        })
+        return False
+
+
+class Tracer:
+    """
+    Collects spans and writes them as Chrome trace-event JSON (opens in Perfetto
+    or chrome://tracing). Disabled by default; every call is then a no-op.
+
+    Spans are laid out per slot: `tid` is the semaphore slot the task holds, so each
+    lane in the viewer shows what one slot was doing over time.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.pid = os.getpid()
+        self._origin = time.perf_counter()
+        self._events = []
+        self._named_tids = set()
+
+    def enable(self, path=None):
+        """Starts recording; `path` is where write() saves the trace by default."""
+        self.enabled = True
+        self.path = path
+        self._origin = time.perf_counter()
+        self.name_thread(0, "main")
+
+    def _now(self):
+        return (time.perf_counter() - self._origin) * 1_000_000
+
+    def _add(self, event):
+        self._events.append(event)
+
+    def name_thread(self, tid, name):
+        if not self.enabled or tid in self._named_tids:
+            return
+        self._named_tids.add(tid)
+        self._add({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+
+    def span(self, name, cat, **args):
+        """Context manager recording a complete ('X') event for the enclosed block."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def instant(self, name, cat, **args):
+        if not self.enabled:
+            return
+        task_id = current_task.get()
+        if task_id is not None:
+            args.setdefault('task', task_id)
+        self._add({'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'ts': self._now(),
+                   'pid': self.pid, 'tid': current_slot.get(), 'args': args})
+
+    def async_begin(self, name, cat, span_id, **args):
+        """Begins a nestable async event, for waits that overlap freely (e.g. queueing)."""
+        if self.enabled:
+            self._add({'name': name, 'cat': cat, 'ph': 'b', 'id': span_id, 'ts': self._now(),
+                       'pid': self.pid, 'tid': 0, 'args': args})
+
+    def async_end(self, name, cat, span_id):
+        if self.enabled:
+            self._add({'name': name, 'cat': cat, 'ph': 'e', 'id': span_id, 'ts': self._now(),
+                       'pid': self.pid, 'tid': 0})
+
+    def write(self, path=None):
+        path = path or self.path
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        return path
+
+
+tracer = Tracer()
+
+
+class SlotPool:
+    """
+    Hands out stable slot IDs to holders of a semaphore of the same size, so spans of
+    concurrent tasks land on separate, properly nested lanes.
+    """
+
+    def __init__(self, size, base=1, label="slot"):
+        self._free = list(range(base + size - 1, base - 1, -1))
+        for slot in self._free:
+            tracer.name_thread(slot, f"{label} {slot - base + 1}")
+
+    def acquire(self, bind=True):
+        """Takes a free slot; with bind=False the current task's slot (trace lane) is left as is."""
+        slot = self._free.pop()
+        if bind:
+            current_slot.set(slot)
+        return slot
+
+    def release(self, slot, bind=True):
+        self._free.append(slot)
+        if bind:
+            current_slot.set(0)
+
+
+def traced(cat):
+    """Decorator recording each call of a (synchronous) function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(func.__name__, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ExportProfiler:
+    """
+    CPU profiler for the export phase. Uses pyinstrument (async-aware) when it is
+    installed, otherwise falls back to the standard library's cProfile.
+    """
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode='enabled')
+            self.backend = 'pyinstrument'
+        except ImportError:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self.backend = 'cProfile'
+
+    def start(self):
+        if self.backend == 'pyinstrument':
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.backend == 'pyinstrument':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def save(self, base_path):
+        """Writes the profile next to `base_path` and returns the written file's path."""
+        if self.backend == 'pyinstrument':
+            path = base_path + ".html"
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self._profiler.output_html())
+        else:
+            path = base_path + ".prof"
+            self._profiler.dump_stats(path)
+        return path